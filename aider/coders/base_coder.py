@@ -19,10 +19,11 @@ from rich.markdown import Markdown
 from aider import models, prompts, utils
 from aider.commands import Commands
 from aider.history import ChatSummary
-from aider.io import InputOutput
+from aider.io import BufferedIO, InputOutput
 from aider.repo import GitRepo
-from aider.repomap import RepoMap
+from aider.repomap import RepoMap, RepoMapCancelled
 from aider.sendchat import send_with_retries
+from aider.watch import get_file_watcher
 
 from ..dump import dump  # noqa: F401
 
@@ -46,7 +47,11 @@ class Coder:
     last_aider_commit_hash = None
     last_asked_for_commit_time = 0
     repo_map = None
+    repo_map_thread = None
+    watcher = None
+    watch_seq = None
     functions = None
+    files_messages_tokens = None
     total_cost = 0.0
     num_exhausted_context_windows = 0
     num_malformed_responses = 0
@@ -102,8 +107,17 @@ class Coder:
         show_diffs=False,
         auto_commits=True,
         dirty_commits=True,
+        background_commit_messages=False,
         dry_run=False,
         map_tokens=1024,
+        map_processes=None,
+        map_cache_dir=None,
+        map_ranking="networkx",
+        map_render_cache=False,
+        map_max_file_size=1024 * 1024,
+        map_max_line_length=5000,
+        map_parse_timeout=5.0,
+        watch_files=False,
         verbose=False,
         assistant_output_color="blue",
         code_theme="default",
@@ -124,6 +138,9 @@ class Coder:
         self.chat_completion_response_hashes = []
         self.need_commit_before_edits = set()
 
+        # the repo map thread lists the files too, see repo_map_worker()
+        self.files_lock = threading.RLock()
+
         self.verbose = verbose
         self.abs_fnames = set()
         self.cur_messages = []
@@ -137,6 +154,7 @@ class Coder:
 
         self.auto_commits = auto_commits
         self.dirty_commits = dirty_commits
+        self.background_commit_messages = background_commit_messages
         self.assistant_output_color = assistant_output_color
         self.code_theme = code_theme
 
@@ -185,6 +203,12 @@ class Coder:
             self.io.tool_output("Git repo: none")
             self.find_common_root()
 
+        if watch_files:
+            self.watcher = get_file_watcher(self.root)
+            self.file_checks = dict()
+            if self.verbose:
+                self.io.tool_output(f"Watching files with {self.watcher.backend}")
+
         if main_model.use_repo_map and self.repo and self.gpt_prompts.repo_content_prefix:
             self.repo_map = RepoMap(
                 map_tokens,
@@ -193,6 +217,14 @@ class Coder:
                 io,
                 self.gpt_prompts.repo_content_prefix,
                 self.verbose,
+                map_processes,
+                map_cache_dir,
+                map_ranking,
+                map_render_cache,
+                self.watcher,
+                map_max_file_size,
+                map_max_line_length,
+                map_parse_timeout,
             )
 
         if map_tokens > 0:
@@ -293,56 +325,72 @@ class Coder:
         return
 
     def get_files_content(self, fnames=None):
+        return "".join(self.get_files_blocks(fnames))
+
+    def get_files_blocks(self, fnames=None):
         if not fnames:
             fnames = self.abs_fnames
 
-        prompt = ""
+        blocks = []
         for fname, content in self.get_abs_fnames_content():
-            relative_fname = self.get_rel_fname(fname)
-            prompt += "\n"
-            prompt += relative_fname
-            prompt += f"\n{self.fence[0]}\n"
+            blocks.append(self.get_file_block(fname, content))
 
-            prompt += content
+        return blocks
 
-            # lines = content.splitlines(keepends=True)
-            # lines = [f"{i+1:03}:{line}" for i, line in enumerate(lines)]
-            # prompt += "".join(lines)
+    def get_file_block(self, fname, content):
+        relative_fname = self.get_rel_fname(fname)
+        block = "\n"
+        block += relative_fname
+        block += f"\n{self.fence[0]}\n"
 
-            prompt += f"{self.fence[1]}\n"
+        block += content
 
-        return prompt
+        # lines = content.splitlines(keepends=True)
+        # lines = [f"{i+1:03}:{line}" for i, line in enumerate(lines)]
+        # block += "".join(lines)
+
+        block += f"{self.fence[1]}\n"
+        return block
 
     def get_repo_map(self):
         if not self.repo_map:
             return
 
-        other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
+        # the background thread already listed the files, if it finished
+        other_files = self.repo_map_end()
+        if other_files is None:
+            other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
         repo_content = self.repo_map.get_repo_map(self.abs_fnames, other_files)
         return repo_content
 
     def get_files_messages(self):
-        all_content = ""
+        blocks = []
 
         repo_content = self.get_repo_map()
         if repo_content:
-            if all_content:
-                all_content += "\n"
-            all_content += repo_content
+            blocks.append(repo_content)
 
         if self.abs_fnames:
-            files_content = self.gpt_prompts.files_content_prefix
-            files_content += self.get_files_content()
+            blocks.append(self.gpt_prompts.files_content_prefix)
+            blocks += self.get_files_blocks()
         else:
-            files_content = self.gpt_prompts.files_no_full_files
-
-        all_content += files_content
+            blocks.append(self.gpt_prompts.files_no_full_files)
 
         files_messages = [
-            dict(role="user", content=all_content),
+            dict(role="user", content="".join(blocks)),
             dict(role="assistant", content="Ok."),
         ]
 
+        # Count the files message a block at a time, so only the repo map and
+        # files which changed since the last turn get encoded again.
+        self.files_messages_tokens = None
+        if self.main_model.tokenizer:
+            wrapper = [dict(role="user", content=""), files_messages[1]]
+            self.files_messages_tokens = self.main_model.token_count(wrapper)
+            self.files_messages_tokens += sum(
+                self.main_model.token_count(block) for block in blocks
+            )
+
         return files_messages
 
     def run(self, with_message=None):
@@ -408,6 +456,85 @@ class Coder:
         self.done_messages = self.summarized_done_messages
         self.summarized_done_messages = []
 
+    def repo_map_start(self):
+        # Build the repo map on a background thread while the user is typing,
+        # so get_repo_map() can just reuse the memoized result.
+        if not self.repo_map or self.repo_map.cache_missing:
+            return
+
+        chat_files = set(self.abs_fnames)
+        if self.repo_map_thread is not None:
+            thread, thread_chat_files, cancelled, _result = self.repo_map_thread
+            if thread_chat_files == chat_files and not cancelled.is_set():
+                return
+            cancelled.set()
+
+        cancelled = threading.Event()
+        result = dict(io=BufferedIO(self.io), other_files=None)
+        thread = threading.Thread(
+            target=self.repo_map_worker, args=(chat_files, cancelled, result), daemon=True
+        )
+        self.repo_map_thread = (thread, chat_files, cancelled, result)
+        thread.start()
+
+    def repo_map_worker(self, chat_files, cancelled, result):
+        # The prompt is up, so anything the map reports is held back in a
+        # BufferedIO for repo_map_end() to show.
+        io = result["io"]
+        try:
+            other_files = set(self.get_all_abs_files()) - chat_files
+
+            with self.repo_map.lock:
+                self.repo_map.io = io
+                try:
+                    self.repo_map.get_repo_map(chat_files, other_files, cancelled)
+                finally:
+                    self.repo_map.io = self.io
+
+            result["other_files"] = other_files
+            self.prepare_files_tokens(chat_files)
+        except RepoMapCancelled:
+            pass
+        except Exception as err:
+            # get_repo_map() will try again, and report it, in the foreground
+            if self.verbose:
+                io.tool_error(f"Background repo map failed: {err}")
+
+    def prepare_files_tokens(self, chat_files):
+        # Count the chat files' tokens ahead of time, so get_files_messages()
+        # finds them in the token count cache. Unreadable files are left for
+        # it to report and drop.
+        if not self.main_model.tokenizer:
+            return
+
+        for fname in chat_files:
+            try:
+                content = Path(fname).read_text(encoding=self.io.encoding)
+            except (OSError, UnicodeError):
+                continue
+            self.main_model.token_count(self.get_file_block(fname, content))
+
+    def repo_map_end(self):
+        # Wait for the background repo map, show what it reported, and return
+        # the other files it mapped, or None if it's of no use.
+        if self.repo_map_thread is None:
+            return
+
+        thread, chat_files, cancelled, result = self.repo_map_thread
+        self.repo_map_thread = None
+
+        # the chat files changed since it started, so it's no use
+        if chat_files != self.abs_fnames:
+            cancelled.set()
+
+        thread.join()
+
+        if cancelled.is_set():
+            return
+
+        result["io"].flush()
+        return result["other_files"]
+
     def move_back_cur_messages(self, message):
         self.done_messages += self.cur_messages
         self.summarize_start()
@@ -420,6 +547,9 @@ class Coder:
         self.cur_messages = []
 
     def run_loop(self):
+        self.repo_map_start()
+        self.apply_commit_message(wait=False)
+
         inp = self.io.get_input(
             self.root,
             self.get_inchat_relative_files(),
@@ -427,6 +557,8 @@ class Coder:
             self.commands,
         )
 
+        self.apply_commit_message(wait=False)
+
         if not inp:
             return
 
@@ -452,13 +584,16 @@ class Coder:
 
         self.summarize_end()
         messages += self.done_messages
+        messages_tokens = self.main_model.token_count(messages)
+
         messages += self.get_files_messages()
+        if messages_tokens is not None:
+            messages_tokens += self.files_messages_tokens
 
         reminder_message = [
             dict(role="system", content=self.fmt_system_prompt(self.gpt_prompts.system_reminder)),
         ]
 
-        messages_tokens = self.main_model.token_count(messages)
         reminder_tokens = self.main_model.token_count(reminder_message)
         cur_tokens = self.main_model.token_count(self.cur_messages)
 
@@ -751,13 +886,44 @@ class Coder:
         return sorted(set(files))
 
     def get_all_relative_files(self):
-        if self.repo:
-            files = self.repo.get_tracked_files()
+        with self.files_lock:
+            if self.repo:
+                files = self.repo.get_tracked_files()
+            else:
+                files = self.get_inchat_relative_files()
+
+            if self.watcher:
+                files = self.filter_watched_files(files)
+            else:
+                files = [fname for fname in files if Path(self.abs_root_path(fname)).is_file()]
+            return sorted(set(files))
+
+    def filter_watched_files(self, files):
+        # only re-check the files the watcher saw change
+        changed, self.watch_seq = self.watcher.get_changes(self.watch_seq)
+        if changed is None:
+            self.file_checks = dict()
         else:
-            files = self.get_inchat_relative_files()
+            for fname in changed:
+                self.file_checks.pop(self.get_rel_fname(fname), None)
 
-        files = [fname for fname in files if Path(self.abs_root_path(fname)).is_file()]
-        return sorted(set(files))
+        res = []
+        abs_fnames = []
+        for fname in files:
+            check = self.file_checks.get(fname)
+            if check is None:
+                abs_fname = self.abs_root_path(fname)
+                check = (abs_fname, Path(abs_fname).is_file())
+                self.file_checks[fname] = check
+
+            abs_fname, is_file = check
+            abs_fnames.append(abs_fname)
+            if is_file:
+                res.append(fname)
+
+        self.watcher.track(abs_fnames)
+
+        return res
 
     def get_all_abs_files(self):
         files = self.get_all_relative_files()
@@ -893,6 +1059,16 @@ class Coder:
 
         self.apply_update_errors = 0
 
+        if self.watcher:
+            for path in edited:
+                self.watcher.mark_changed(self.abs_root_path(path))
+
+        if self.repo_map and not self.dry_run:
+            # parse the edits now, so the next repo map finds the tags cached
+            for path in edited:
+                full_path = self.abs_root_path(path)
+                self.repo_map.update_file(full_path, self.io.read_text(full_path))
+
         for path in edited:
             if self.dry_run:
                 self.io.tool_output(f"Did not apply edit to {path} (--dry-run)")
@@ -938,8 +1114,15 @@ class Coder:
         return context
 
     def auto_commit(self, edited):
+        self.apply_commit_message()
+
         context = self.get_context_from_history(self.cur_messages)
-        res = self.repo.commit(fnames=edited, context=context, prefix="aider: ")
+        res = self.repo.commit(
+            fnames=edited,
+            context=context,
+            prefix="aider: ",
+            background=self.background_commit_messages,
+        )
         if res:
             commit_hash, commit_message = res
             self.last_aider_commit_hash = commit_hash
@@ -952,6 +1135,18 @@ class Coder:
         self.io.tool_output("No changes made to git tracked files.")
         return self.gpt_prompts.files_content_gpt_no_edits
 
+    def apply_commit_message(self, wait=True, timeout=None):
+        if not self.repo:
+            return
+
+        res = self.repo.apply_commit_message(wait, timeout)
+        if not res:
+            return
+
+        old_hash, new_hash = res
+        if self.last_aider_commit_hash == old_hash:
+            self.last_aider_commit_hash = new_hash
+
     def dirty_commit(self):
         if not self.need_commit_before_edits:
             return
@@ -960,7 +1155,10 @@ class Coder:
         if not self.repo:
             return
 
-        self.repo.commit(fnames=self.need_commit_before_edits)
+        self.apply_commit_message()
+        self.repo.commit(
+            fnames=self.need_commit_before_edits, background=self.background_commit_messages
+        )
 
         # files changed, move cur messages back behind the files messages
         self.move_back_cur_messages(self.gpt_prompts.files_content_local_edits)
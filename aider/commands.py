@@ -6,7 +6,7 @@ from pathlib import Path
 import git
 from prompt_toolkit.completion import Completion
 
-from aider import prompts, voice
+from aider import prompts
 
 from .dump import dump  # noqa: F401
 
@@ -89,6 +89,8 @@ class Commands:
             self.io.tool_error("No more changes to commit.")
             return
 
+        self.coder.apply_commit_message()
+
         commit_message = args.strip()
         self.coder.repo.commit(message=commit_message)
 
@@ -186,6 +188,8 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.apply_commit_message()
+
         if self.coder.repo.is_dirty():
             self.io.tool_error(
                 "The repository has uncommitted changes. Please commit or stash them before"
@@ -236,6 +240,8 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.apply_commit_message()
+
         if not self.coder.last_aider_commit_hash:
             self.io.tool_error("No previous aider commit found.")
             self.io.tool_error("You could try `/git diff` or `/git diff HEAD^`.")
@@ -330,6 +336,8 @@ class Commands:
         if not added_fnames:
             return
 
+        self.coder.repo_map_start()
+
         # only reply if there's been some chatting since the last edit
         if not self.coder.cur_messages:
             return
@@ -364,8 +372,12 @@ class Commands:
                     self.coder.abs_fnames.remove(abs_fname)
                     self.io.tool_output(f"Removed {matched_file} from the chat")
 
+        self.coder.repo_map_start()
+
     def cmd_git(self, args):
         "Run a git command"
+        self.coder.apply_commit_message()
+
         combined_output = None
         try:
             args = "git " + args
@@ -459,6 +471,8 @@ class Commands:
 
     def cmd_voice(self, args):
         "Record and transcribe voice input"
+        # numpy and the sound libraries are slow to import
+        from aider import voice
 
         if not self.voice:
             try:
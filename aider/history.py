@@ -4,10 +4,14 @@ import json
 from aider import models, prompts
 from aider.dump import dump  # noqa: F401
 from aider.sendchat import simple_send_with_retries
+from aider.utils import count_tokens
 
 
 class ChatSummary:
-    def __init__(self, client, model=models.Model.weak_model(), max_tokens=1024):
+    def __init__(self, client, model=None, max_tokens=1024):
+        if not model:
+            model = models.Model.weak_model()
+
         self.client = client
         self.tokenizer = model.tokenizer
         self.max_tokens = max_tokens
@@ -21,7 +25,7 @@ class ChatSummary:
     def tokenize(self, messages):
         sized = []
         for msg in messages:
-            tokens = len(self.tokenizer.encode(json.dumps(msg)))
+            tokens = count_tokens(self.tokenizer, json.dumps(msg))
             sized.append((tokens, msg))
         return sized
 
@@ -61,7 +65,7 @@ class ChatSummary:
         summary = self.summarize_all(head)
 
         tail_tokens = sum(tokens for tokens, msg in sized[split_index:])
-        summary_tokens = len(self.tokenizer.encode(json.dumps(summary)))
+        summary_tokens = sum(count_tokens(self.tokenizer, json.dumps(msg)) for msg in summary)
 
         result = summary + tail
         if summary_tokens + tail_tokens < self.max_tokens:
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import httpx
+
+from aider.dump import dump  # noqa: F401
+
+# One api request, and whether it had to open a new connection to send it
+Call = namedtuple("Call", "path new_connection connect_time".split())
+
+# Kept alive between chat turns, rather than httpx's default of 5 seconds,
+# so a turn doesn't have to reconnect and redo the TLS handshake.
+KEEPALIVE_EXPIRY = 300
+
+LIMITS = httpx.Limits(
+    max_connections=20,
+    max_keepalive_connections=10,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+
+# Non-streamed completions can take minutes, but connecting shouldn't.
+TIMEOUT = httpx.Timeout(600.0, connect=10.0, pool=30.0)
+
+
+class ConnectionStats:
+    def __init__(self, output=None):
+        self.output = output
+        self.lock = threading.Lock()
+        self.calls = deque(maxlen=1000)
+        self.num_calls = 0
+        self.num_connections = 0
+        self.messages = []
+
+    def on_request(self, request):
+        # httpcore reports each step of sending the request to the trace
+        # callback, and only connects when no pooled connection was free.
+        connect_start = None
+        connect_time = None
+
+        def trace(event_name, info):
+            nonlocal connect_start, connect_time
+
+            if event_name == "connection.connect_tcp.started":
+                connect_start = time.perf_counter()
+            elif event_name in (
+                "connection.connect_tcp.complete",
+                "connection.start_tls.complete",
+            ):
+                connect_time = time.perf_counter() - connect_start
+            elif event_name.endswith(".send_request_headers.started"):
+                self.add_call(Call(request.url.path, connect_start is not None, connect_time))
+
+        request.extensions["trace"] = trace
+
+    def add_call(self, call):
+        with self.lock:
+            self.calls.append(call)
+            self.num_calls += 1
+            if call.new_connection:
+                self.num_connections += 1
+
+            if self.output:
+                if call.new_connection:
+                    message = f"{call.path}: new connection in {call.connect_time:.3f}s"
+                else:
+                    message = f"{call.path}: reused connection"
+                self.messages.append(message)
+
+        # Calls from background threads, like the summarizer or commit
+        # messages, may happen while the user is typing. So only the main
+        # thread prints, and it prints theirs with its next call.
+        if threading.current_thread() is threading.main_thread():
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            messages, self.messages = self.messages, []
+
+        for message in messages:
+            self.output(message)
+
+    def summary(self):
+        with self.lock:
+            reused = self.num_calls - self.num_connections
+            return (
+                f"{self.num_calls} api calls over {self.num_connections} connections,"
+                f" {reused} reused"
+            )
+
+
+def has_http2():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_http_client(stats=None, http2=None):
+    # One pooled client for every api call: chat, summaries, commit messages
+    # and the models list. HTTP/2 needs the optional h2 package.
+    if http2 is None:
+        http2 = has_http2()
+
+    event_hooks = dict()
+    if stats:
+        event_hooks["request"] = [stats.on_request]
+
+    return httpx.Client(
+        http2=http2,
+        limits=LIMITS,
+        timeout=TIMEOUT,
+        event_hooks=event_hooks,
+    )
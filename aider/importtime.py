@@ -0,0 +1,88 @@
+import subprocess
+import sys
+from collections import namedtuple
+
+from aider.dump import dump  # noqa: F401
+
+Import = namedtuple("Import", "name importer self_us cumulative_us".split())
+
+
+def parse_importtime(text):
+    "Parse the report python -X importtime writes to stderr, into Imports"
+    imports = []
+    depths = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3:
+            continue
+
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # the header
+            continue
+
+        name = fields[2][1:]
+        stripped = name.lstrip()
+        depths.append((len(name) - len(stripped)) // 2)
+        imports.append(Import(stripped, None, self_us, cumulative_us))
+
+    # Modules are reported after the modules they import, so walk backwards
+    # to find each one's importer.
+    stack = []
+    for i in reversed(range(len(imports))):
+        depth = depths[i]
+        del stack[depth:]
+        if stack:
+            imports[i] = imports[i]._replace(importer=stack[-1])
+        stack.append(imports[i].name)
+
+    return imports
+
+
+def is_aider_module(name):
+    return name == "aider" or name.startswith("aider.")
+
+
+def get_slowest_imports(imports, limit=20):
+    # The packages aider imports directly, which are what a lazy import can
+    # avoid, including everything they import in turn.
+    direct = [
+        imp
+        for imp in imports
+        if not is_aider_module(imp.name) and (not imp.importer or is_aider_module(imp.importer))
+    ]
+    direct.sort(key=lambda imp: imp.cumulative_us, reverse=True)
+    return direct[:limit]
+
+
+def profile_startup(argv, io):
+    cmd = [sys.executable, "-X", "importtime", "-m", "aider.main"] + list(argv)
+    res = subprocess.run(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    imports = parse_importtime(res.stderr)
+    total_us = sum(imp.cumulative_us for imp in imports if not imp.importer)
+
+    io.tool_output(f"Imported {len(imports)} modules in {total_us / 1e6:.2f}s, the slowest:")
+    io.tool_output()
+    io.tool_output(f"{'ms':>8}  {'module':40} imported by")
+    for imp in get_slowest_imports(imports):
+        importer = imp.importer or "-"
+        io.tool_output(f"{imp.cumulative_us / 1000:8.1f}  {imp.name:40} {importer}")
+
+    if res.returncode:
+        io.tool_error(f"aider exited with status {res.returncode} before it finished starting")
+        errors = [line for line in res.stderr.splitlines() if not line.startswith("import time:")]
+        if errors:
+            io.tool_error(errors[-1])
+        return res.returncode
@@ -339,3 +339,33 @@ class InputOutput:
         if self.chat_history_file is not None:
             with self.chat_history_file.open("a", encoding=self.encoding) as f:
                 f.write(text)
+
+
+class BufferedIO:
+    """
+    Stands in for an InputOutput on a background thread, holding back its
+    tool messages until flush() shows them, from the main thread, so they
+    don't print over the user's prompt.
+    """
+
+    def __init__(self, io):
+        self.io = io
+        self.messages = []
+
+    def __getattr__(self, name):
+        return getattr(self.io, name)
+
+    def read_text(self, filename):
+        # so its errors go through the buffered tool_error()
+        return InputOutput.read_text(self, filename)
+
+    def tool_error(self, message):
+        self.messages.append((self.io.tool_error, (message,), dict()))
+
+    def tool_output(self, *messages, log_only=False):
+        self.messages.append((self.io.tool_output, messages, dict(log_only=log_only)))
+
+    def flush(self):
+        messages, self.messages = self.messages, []
+        for method, args, kwargs in messages:
+            method(*args, **kwargs)
@@ -5,13 +5,9 @@ from pathlib import Path
 
 import configargparse
 import git
-import openai
 
 from aider import __version__, models
-from aider.coders import Coder
 from aider.io import InputOutput
-from aider.repo import GitRepo
-from aider.versioncheck import check_version
 
 from .dump import dump  # noqa: F401
 
@@ -27,6 +23,7 @@ def get_git_root():
 
 def guessed_wrong_repo(io, git_root, fnames, git_dname):
     """After we parse the args, we can determine the real repo. Did we guess wrong?"""
+    from aider.repo import GitRepo
 
     try:
         check_repo = Path(GitRepo(io, fnames, git_dname).root).resolve()
@@ -214,6 +211,123 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         default=1024,
         help="Max number of tokens to use for repo map, use 0 to disable (default: 1024)",
     )
+    model_group.add_argument(
+        "--map-processes",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes used to build the repo map tags cache, use 1 to disable"
+            " (default: number of CPUs)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-cache-dir",
+        metavar="MAP_CACHE_DIR",
+        default=None,
+        help=(
+            "Specify a directory for a repo map tags cache keyed by file content, which can be"
+            " shared across clones, worktrees and machines (default: None)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-ranking",
+        choices=["networkx", "scipy"],
+        default="networkx",
+        help="Specify the ranking backend for the repo map (default: networkx)",
+    )
+    model_group.add_argument(
+        "--map-render-cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Enable/disable caching rendered repo map file outlines on disk (default: False)",
+    )
+    model_group.add_argument(
+        "--map-max-file-size",
+        type=int,
+        default=1024 * 1024,
+        metavar="BYTES",
+        help=(
+            "Skip files larger than this when building the repo map, 0 for no limit (default: 1MB)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-max-line-length",
+        type=int,
+        default=5000,
+        help=(
+            "Skip files with longer lines than this when building the repo map, as likely"
+            " minified, 0 for no limit (default: 5000)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-parse-timeout",
+        type=float,
+        default=5.0,
+        metavar="SECONDS",
+        help="Skip files which take longer than this to parse for the repo map (default: 5)",
+    )
+    model_group.add_argument(
+        "--watch-files",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable watching the repo for changes (inotify, or polling), instead of"
+            " checking every file each turn (default: False)"
+        ),
+    )
+
+    model_group.add_argument(
+        "--response-cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable caching LLM responses on disk, so repeating an identical request"
+            " re-uses the response (default: False)"
+        ),
+    )
+    model_group.add_argument(
+        "--response-cache-dir",
+        metavar="RESPONSE_CACHE_DIR",
+        default="~/.aider.send.cache.v1",
+        help="Specify the directory for the response cache (default: ~/.aider.send.cache.v1)",
+    )
+    model_group.add_argument(
+        "--response-cache-size",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="Evict the least recently used responses over this size (default: 1024)",
+    )
+    model_group.add_argument(
+        "--response-cache-max-age",
+        type=float,
+        default=30,
+        metavar="DAYS",
+        help="Expire cached responses older than this, 0 for no limit (default: 30)",
+    )
+
+    model_group.add_argument(
+        "--record-responses",
+        metavar="DIR",
+        help="Record every LLM response to this directory, including the timing of streamed chunks",
+    )
+    model_group.add_argument(
+        "--replay-responses",
+        metavar="DIR",
+        help=(
+            "Answer requests with the responses recorded in this directory, instead of calling"
+            " the api"
+        ),
+    )
+    model_group.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help=(
+            "Replay streamed responses this many times faster than recorded, 0 for as fast as"
+            " possible (default: 1)"
+        ),
+    )
 
     ##########
     history_group = parser.add_argument_group("History Files")
@@ -332,6 +446,15 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         default=True,
         help="Enable/disable commits when repo is found dirty (default: True)",
     )
+    git_group.add_argument(
+        "--background-commit-messages",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help=(
+            "Enable/disable committing right away and rewording the commit once its message is"
+            " generated, instead of waiting for the message (default: True)"
+        ),
+    )
     git_group.add_argument(
         "--dry-run",
         action=argparse.BooleanOptionalAction,
@@ -353,6 +476,12 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         version=f"%(prog)s {__version__}",
         help="Show the version number and exit",
     )
+    other_group.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report how long each module aider imports takes to load while starting, then exit",
+        default=False,
+    )
     other_group.add_argument(
         "--apply",
         metavar="FILE",
@@ -437,6 +566,21 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         encoding=args.encoding,
     )
 
+    # the profile is of a new process, run with python -X importtime
+    if args.profile_startup and "importtime" not in sys._xoptions:
+        from aider.importtime import profile_startup
+
+        return profile_startup(argv, io)
+
+    # openai, the coders and the repo map are slow to import, so wait until
+    # the args show they are needed
+    import openai
+
+    from aider import sendchat
+    from aider.coders import Coder
+    from aider.httpclient import ConnectionStats, make_http_client
+    from aider.versioncheck import check_version
+
     fnames = [str(Path(fn).resolve()) for fn in args.files]
     if len(args.files) > 1:
         good = True
@@ -483,6 +627,8 @@ def main(argv=None, input=None, output=None, force_git_root=None):
 
     def scrub_sensitive_info(text):
         # Replace sensitive information with placeholder
+        if not args.openai_api_key:
+            return text
         return text.replace(args.openai_api_key, "***")
 
     if args.verbose:
@@ -494,7 +640,7 @@ def main(argv=None, input=None, output=None, force_git_root=None):
 
     io.tool_output(*sys.argv, log_only=True)
 
-    if not args.openai_api_key:
+    if not args.openai_api_key and not args.replay_responses:
         if os.name == "nt":
             io.tool_error(
                 "No OpenAI API key provided. Use --openai-api-key or setx OPENAI_API_KEY."
@@ -505,24 +651,46 @@ def main(argv=None, input=None, output=None, force_git_root=None):
             )
         return 1
 
-    if args.openai_api_type == "azure":
-        client = openai.AzureOpenAI(
-            api_key=args.openai_api_key,
-            azure_endpoint=args.openai_api_base,
-            api_version=args.openai_api_version,
-            azure_deployment=args.openai_api_deployment_id,
-        )
-    else:
-        kwargs = dict()
-        if args.openai_api_base:
-            kwargs["base_url"] = args.openai_api_base
-            if "openrouter.ai" in args.openai_api_base:
-                kwargs["default_headers"] = {
-                    "HTTP-Referer": "http://aider.chat",
-                    "X-Title": "Aider",
-                }
+    connection_stats = None
+    if args.replay_responses:
+        from aider.replay import ReplayClient
 
-        client = openai.OpenAI(api_key=args.openai_api_key, **kwargs)
+        client = ReplayClient(args.replay_responses, speed=args.replay_speed)
+    else:
+        connection_stats = ConnectionStats(io.tool_output if args.verbose else None)
+        http_client = make_http_client(connection_stats)
+
+        if args.openai_api_type == "azure":
+            client = openai.AzureOpenAI(
+                api_key=args.openai_api_key,
+                azure_endpoint=args.openai_api_base,
+                api_version=args.openai_api_version,
+                azure_deployment=args.openai_api_deployment_id,
+                http_client=http_client,
+            )
+        else:
+            kwargs = dict()
+            if args.openai_api_base:
+                kwargs["base_url"] = args.openai_api_base
+                if "openrouter.ai" in args.openai_api_base:
+                    kwargs["default_headers"] = {
+                        "HTTP-Referer": "http://aider.chat",
+                        "X-Title": "Aider",
+                    }
+
+            client = openai.OpenAI(api_key=args.openai_api_key, http_client=http_client, **kwargs)
+
+    if args.record_responses:
+        from aider.replay import Recorder
+
+        sendchat.RECORDER = Recorder(args.record_responses)
+
+    if args.response_cache:
+        sendchat.enable_cache(
+            args.response_cache_dir,
+            size_limit=args.response_cache_size * 1024 * 1024,
+            max_age=args.response_cache_max_age * 24 * 60 * 60,
+        )
 
     main_model = models.Model.create(args.model, client)
 
@@ -540,8 +708,17 @@ def main(argv=None, input=None, output=None, force_git_root=None):
             show_diffs=args.show_diffs,
             auto_commits=args.auto_commits,
             dirty_commits=args.dirty_commits,
+            background_commit_messages=args.background_commit_messages,
             dry_run=args.dry_run,
             map_tokens=args.map_tokens,
+            map_processes=args.map_processes,
+            map_cache_dir=args.map_cache_dir,
+            map_ranking=args.map_ranking,
+            map_render_cache=args.map_render_cache,
+            map_max_file_size=args.map_max_file_size,
+            map_max_line_length=args.map_max_line_length,
+            map_parse_timeout=args.map_parse_timeout,
+            watch_files=args.watch_files,
             verbose=args.verbose,
             assistant_output_color=args.assistant_output_color,
             code_theme=args.code_theme,
@@ -554,6 +731,9 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         io.tool_error(str(err))
         return 1
 
+    if args.profile_startup:
+        return
+
     if args.commit:
         coder.commands.cmd_commit("")
         return
@@ -583,23 +763,31 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         io.tool_error(f"Cur working dir: {Path.cwd()}")
         io.tool_error(f"Git working dir: {git_root}")
 
-    if args.message:
-        io.add_to_input_history(args.message)
-        io.tool_output()
-        coder.run(with_message=args.message)
-    elif args.message_file:
-        try:
-            message_from_file = io.read_text(args.message_file)
+    try:
+        if args.message:
+            io.add_to_input_history(args.message)
             io.tool_output()
-            coder.run(with_message=message_from_file)
-        except FileNotFoundError:
-            io.tool_error(f"Message file not found: {args.message_file}")
-            return 1
-        except IOError as e:
-            io.tool_error(f"Error reading message file: {e}")
-            return 1
-    else:
-        coder.run()
+            coder.run(with_message=args.message)
+        elif args.message_file:
+            try:
+                message_from_file = io.read_text(args.message_file)
+                io.tool_output()
+                coder.run(with_message=message_from_file)
+            except FileNotFoundError:
+                io.tool_error(f"Message file not found: {args.message_file}")
+                return 1
+            except IOError as e:
+                io.tool_error(f"Error reading message file: {e}")
+                return 1
+        else:
+            coder.run()
+    finally:
+        # don't leave the last commit with its provisional message, even
+        # after /exit or a second ^C, but don't hang on a slow or rate
+        # limited api either
+        coder.apply_commit_message(timeout=5)
+        if connection_stats:
+            connection_stats.flush()
 
 
 if __name__ == "__main__":
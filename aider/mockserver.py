@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""
+A local stand-in for the OpenAI api, for testing and benchmarking aider
+without a network or an api key.
+
+    python -m aider.mockserver --port 8000 --ttft 0.5 --tokens-per-sec 40 --fault 429=0.1
+    aider --openai-api-base http://127.0.0.1:8000/v1 --openai-api-key mock
+
+It serves the models list and chat completions, streamed or not, with a
+configurable time to first token, tokens per second and injected faults.
+"""
+
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aider.dump import dump  # noqa: F401
+
+# "drop" closes the connection without a response, "drop_stream" part way
+# through streaming one
+FAULTS = (429, 500, "drop", "drop_stream")
+
+
+class MockServer:
+    """
+    Serves chat completions, with the reply to each request from responses:
+    a string, a list of strings used in turn, or a function of the request
+    json. By default the last message is echoed back.
+
+    Faults are injected first from the faults list, one per request in
+    order, then at random with fault_rates, a dict of fault to probability.
+
+    openai.OpenAI retries 429 and 500 errors itself, so use max_retries=0
+    to see them from send_with_retries.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        models=("gpt-4", "gpt-4-1106-preview", "gpt-3.5-turbo", "gpt-3.5-turbo-1106"),
+        responses=None,
+        ttft=0,
+        tokens_per_sec=None,
+        faults=None,
+        fault_rates=None,
+        seed=None,
+    ):
+        self.models = list(models)
+        self.responses = responses
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.faults = list(faults or [])
+        self.fault_rates = dict(fault_rates or {})
+        self.random = random.Random(seed)
+
+        for fault in self.faults + list(self.fault_rates):
+            if fault is not None and fault not in FAULTS:
+                raise ValueError(f"Unknown fault {fault!r}, use one of {FAULTS}")
+
+        self.lock = threading.Lock()
+        self.requests = []
+        self.faults_served = []
+
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def next_request(self, request):
+        # Pick the reply and fault for a request, under the lock so a script
+        # is followed in order even with concurrent requests.
+        with self.lock:
+            num = len(self.requests)
+            self.requests.append(request)
+
+            if self.faults:
+                fault = self.faults.pop(0)
+            else:
+                fault = None
+                for fault_type, rate in self.fault_rates.items():
+                    if self.random.random() < rate:
+                        fault = fault_type
+                        break
+
+            if fault:
+                self.faults_served.append(fault)
+
+            responses = self.responses
+            if responses is None:
+                messages = request.get("messages") or [dict(content="")]
+                content = messages[-1].get("content") or ""
+            elif callable(responses):
+                content = responses(request)
+            elif isinstance(responses, str):
+                content = responses
+            else:
+                content = responses[num % len(responses)]
+
+        return content, fault
+
+    def tokenize(self, content):
+        return re.findall(r"\s*\S+|\s+", content)
+
+    def token_delay(self):
+        if self.tokens_per_sec:
+            return 1.0 / self.tokens_per_sec
+        return 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/v1/models", "/models"):
+            return self.send_json(404, error_body("Not found", "invalid_request_error"))
+
+        models = [
+            dict(id=model, object="model", created=0, owned_by="aider-mock")
+            for model in self.mock.models
+        ]
+        self.send_json(200, dict(object="list", data=models))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.send_json(400, error_body("Invalid json", "invalid_request_error"))
+
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            return self.send_json(404, error_body("Not found", "invalid_request_error"))
+
+        content, fault = self.mock.next_request(request)
+
+        if fault == 429:
+            return self.send_json(429, error_body("Rate limit reached", "rate_limit_error"))
+        if fault == 500:
+            return self.send_json(500, error_body("The server had an error", "server_error"))
+        if fault == "drop":
+            return self.drop()
+
+        model = request.get("model", "gpt-4")
+        tokens = self.mock.tokenize(content)
+
+        if request.get("stream"):
+            self.send_stream(model, tokens, drop=fault == "drop_stream")
+        else:
+            time.sleep(self.mock.ttft + self.mock.token_delay() * len(tokens))
+            self.send_json(200, completion_body(model, content, len(tokens)))
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, model, tokens, drop=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(self.mock.ttft)
+
+        chunks = [chunk_body(model, dict(role="assistant", content=""))]
+        chunks += [chunk_body(model, dict(content=token)) for token in tokens]
+        chunks.append(chunk_body(model, dict(), finish_reason="stop"))
+
+        for i, chunk in enumerate(chunks):
+            if drop and i >= len(chunks) // 2:
+                return self.drop()
+            if 0 < i < len(chunks) - 1:
+                time.sleep(self.mock.token_delay())
+            self.write_event(json.dumps(chunk))
+
+        self.write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_event(self, data):
+        # as a chunk of the chunked body, so a dropped stream is an
+        # incomplete response rather than one which just ended early
+        data = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def drop(self):
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+
+def error_body(message, error_type):
+    return dict(error=dict(message=message, type=error_type, param=None, code=None))
+
+
+def completion_body(model, content, completion_tokens):
+    return dict(
+        id="chatcmpl-mock",
+        object="chat.completion",
+        created=int(time.time()),
+        model=model,
+        choices=[
+            dict(
+                index=0,
+                message=dict(role="assistant", content=content),
+                finish_reason="stop",
+            )
+        ],
+        usage=dict(
+            prompt_tokens=0,
+            completion_tokens=completion_tokens,
+            total_tokens=completion_tokens,
+        ),
+    )
+
+
+def chunk_body(model, delta, finish_reason=None):
+    return dict(
+        id="chatcmpl-mock",
+        object="chat.completion.chunk",
+        created=int(time.time()),
+        model=model,
+        choices=[dict(index=0, delta=delta, finish_reason=finish_reason)],
+    )
+
+
+def parse_fault_rate(arg):
+    fault, _, rate = arg.partition("=")
+    if fault.isdigit():
+        fault = int(fault)
+    return fault, float(rate or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0, help="Seconds to the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=None)
+    parser.add_argument(
+        "--fault",
+        type=parse_fault_rate,
+        action="append",
+        default=[],
+        metavar="FAULT=RATE",
+        help="Inject a fault (429, 500, drop or drop_stream) into this share of requests",
+    )
+    parser.add_argument("--response", help="Reply with this, instead of echoing the request")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockServer(
+        host=args.host,
+        port=args.port,
+        responses=args.response,
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        fault_rates=dict(args.fault),
+        seed=args.seed,
+    )
+    print(f"Serving a mock OpenAI api at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,30 @@ from .model import Model
 from .openai import OpenAIModel
 from .openrouter import OpenRouterModel
 
-GPT4 = Model.create("gpt-4")
-GPT4_0613 = Model.create("gpt-4-0613")
-GPT4_1106_PREVIEW = Model.create("gpt-4-1106-preview")
-GPT35 = Model.create("gpt-3.5-turbo")
-GPT35_1106 = Model.create("gpt-3.5-turbo-1106")
-GPT35_16k = Model.create("gpt-3.5-turbo-16k")
+# The well known models, created on first access by __getattr__
+MODEL_NAMES = dict(
+    GPT4="gpt-4",
+    GPT4_0613="gpt-4-0613",
+    GPT4_1106_PREVIEW="gpt-4-1106-preview",
+    GPT35="gpt-3.5-turbo",
+    GPT35_1106="gpt-3.5-turbo-1106",
+    GPT35_16k="gpt-3.5-turbo-16k",
+)
+
+
+def __getattr__(name):
+    if name not in MODEL_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    model = Model.create(MODEL_NAMES[name])
+    globals()[name] = model
+    return model
+
 
 __all__ = [
-    OpenAIModel,
-    OpenRouterModel,
-    GPT4,
-    GPT35,
-    GPT35_16k,
+    "OpenAIModel",
+    "OpenRouterModel",
+    "GPT4",
+    "GPT35",
+    "GPT35_16k",
 ]
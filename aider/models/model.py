@@ -1,11 +1,23 @@
 import json
+from functools import lru_cache
+
+from aider.utils import count_tokens
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name):
+    # tiktoken imports requests and loads the BPE tables, which is slow, so
+    # wait until a model first needs to count tokens
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
 
 
 class Model:
     name = None
     edit_format = None
     max_context_tokens = 0
-    tokenizer = None
+    encoding_name = None
     max_chat_history_tokens = 1024
 
     always_available = False
@@ -24,6 +36,22 @@ class Model:
             return OpenRouterModel(client, name)
         return OpenAIModel(name)
 
+    _tokenizer = None
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None and self.encoding_name:
+            self._tokenizer = get_encoding(self.encoding_name)
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    @tokenizer.deleter
+    def tokenizer(self):
+        self._tokenizer = None
+
     def __str__(self):
         return self.name
 
@@ -44,8 +72,7 @@ class Model:
             return
 
         if type(messages) is str:
-            msgs = messages
-        else:
-            msgs = json.dumps(messages)
+            return count_tokens(self.tokenizer, messages)
 
-        return len(self.tokenizer.encode(msgs))
+        # counted a message at a time, so each one is only encoded once
+        return sum(count_tokens(self.tokenizer, json.dumps(msg)) for msg in messages)
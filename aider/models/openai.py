@@ -1,7 +1,5 @@
 import re
 
-import tiktoken
-
 from .model import Model
 
 known_tokens = {
@@ -30,7 +28,7 @@ class OpenAIModel(Model):
             raise ValueError(f"Unknown context window size for model: {name}")
 
         self.max_context_tokens = tokens * 1024
-        self.tokenizer = tiktoken.encoding_for_model(name)
+        self.encoding_name = encoding_name_for_model(name)
 
         if self.is_gpt4():
             if name == "gpt-4-1106-preview":
@@ -83,3 +81,13 @@ class OpenAIModel(Model):
 
     def is_gpt35(self):
         return self.name.startswith("gpt-3.5-turbo")
+
+
+def encoding_name_for_model(name):
+    # tiktoken.model.encoding_name_for_model, without importing tiktoken
+    if name.startswith("gpt-4") or name.startswith("gpt-3.5-turbo"):
+        return "cl100k_base"
+
+    from tiktoken.model import encoding_name_for_model
+
+    return encoding_name_for_model(name)
@@ -1,5 +1,3 @@
-import tiktoken
-
 from .model import Model
 
 cached_model_details = None
@@ -15,7 +13,7 @@ class OpenRouterModel(Model):
         self.use_repo_map = self.edit_format == "diff"
 
         # TODO: figure out proper encodings for non openai models
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.encoding_name = "cl100k_base"
 
         global cached_model_details
         if cached_model_details is None:
@@ -0,0 +1,91 @@
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from aider.dump import dump  # noqa: F401
+from aider.sendchat import get_request_hash
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Recorder:
+    """
+    Saves every completion to a directory, one JSON file per request hash.
+    Streamed completions are saved chunk by chunk, with how long each one
+    took to arrive.
+    """
+
+    def __init__(self, dname):
+        self.dname = Path(dname)
+        self.dname.mkdir(parents=True, exist_ok=True)
+
+    def record(self, key, kwargs, completion, start):
+        if not kwargs.get("stream"):
+            self.save(key, kwargs, completion=completion.model_dump())
+            return completion
+
+        return self.record_stream(key, kwargs, completion, start)
+
+    def record_stream(self, key, kwargs, completion, start):
+        chunks = []
+        last = start
+        for chunk in completion:
+            # only the time spent waiting on the api, not the time the caller
+            # spent rendering the previous chunk
+            chunks.append((time.perf_counter() - last, chunk.model_dump()))
+            yield chunk
+            last = time.perf_counter()
+
+        self.save(key, kwargs, chunks=chunks)
+
+    def save(self, key, kwargs, **recording):
+        recording = dict(model=kwargs["model"], stream=bool(kwargs.get("stream")), **recording)
+        fname = self.dname / f"{key}.json"
+        fname.write_text(json.dumps(recording))
+
+
+class ReplayClient:
+    """
+    Stands in for the openai client, answering each request with the
+    completion a Recorder saved for it. Streamed completions are replayed
+    chunk by chunk, at speed times their original pace, or as fast as
+    possible if speed is 0.
+    """
+
+    def __init__(self, dname, speed=1.0):
+        self.dname = Path(dname)
+        self.speed = speed
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.models = SimpleNamespace(list=self.list_models)
+        self.base_url = SimpleNamespace(host=None)
+
+    def create(self, **kwargs):
+        key = get_request_hash(kwargs).hexdigest()
+        fname = self.dname / f"{key}.json"
+        try:
+            recording = json.loads(fname.read_text())
+        except FileNotFoundError:
+            raise ReplayError(f"No recorded completion for request {key} in {self.dname}")
+
+        if not recording["stream"]:
+            return ChatCompletion.model_validate(recording["completion"])
+
+        return self.replay_stream(recording["chunks"])
+
+    def replay_stream(self, chunks):
+        for delay, chunk in chunks:
+            if self.speed:
+                time.sleep(delay / self.speed)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    def list_models(self):
+        names = set()
+        for fname in self.dname.glob("*.json"):
+            names.add(json.loads(fname.read_text())["model"])
+        return [SimpleNamespace(id=name) for name in sorted(names)]
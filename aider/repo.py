@@ -1,11 +1,12 @@
 import os
+import threading
 from pathlib import Path, PurePosixPath
 
 import git
 import pathspec
 
 from aider import models, prompts, utils
-from aider.sendchat import simple_send_with_retries
+from aider.sendchat import retry_output, simple_send_with_retries
 
 from .dump import dump  # noqa: F401
 
@@ -15,6 +16,7 @@ class GitRepo:
     aider_ignore_file = None
     aider_ignore_spec = None
     aider_ignore_ts = 0
+    pending_message = None
 
     def __init__(self, io, fnames, git_dname, aider_ignore_file=None, client=None):
         self.client = client
@@ -57,7 +59,7 @@ class GitRepo:
         if aider_ignore_file:
             self.aider_ignore_file = Path(aider_ignore_file)
 
-    def commit(self, fnames=None, context=None, prefix=None, message=None):
+    def commit(self, fnames=None, context=None, prefix=None, message=None, background=False):
         if not fnames and not self.repo.is_dirty():
             return
 
@@ -65,8 +67,13 @@ class GitRepo:
         if not diffs:
             return
 
+        pending = None
         if message:
             commit_message = message
+        elif background:
+            # commit now, and reword the commit once the message is ready
+            commit_message = self.get_provisional_message(fnames)
+            pending = self.start_commit_message(diffs, context, prefix)
         else:
             commit_message = self.get_commit_message(diffs, context)
 
@@ -93,17 +100,100 @@ class GitRepo:
         commit_hash = self.repo.head.commit.hexsha[:7]
         self.io.tool_output(f"Commit {commit_hash} {commit_message}")
 
+        if pending:
+            pending["hexsha"] = self.repo.head.commit.hexsha
+            self.pending_message = pending
+
         return commit_hash, commit_message
 
+    def get_provisional_message(self, fnames):
+        if not fnames:
+            return "Commit pending changes"
+
+        fnames = sorted(self.normalize_path(self.abs_root_path(fn)) for fn in fnames)
+        if len(fnames) > 3:
+            fnames = fnames[:3] + [f"{len(fnames) - 3} more"]
+        return "Edit " + ", ".join(fnames)
+
+    def start_commit_message(self, diffs, context, prefix):
+        # the thread mustn't write to the terminal while the user is typing,
+        # so its errors are reported by apply_commit_message()
+        pending = dict(context=context, prefix=prefix, errors=[])
+
+        def generate():
+            try:
+                with retry_output(pending["errors"].append):
+                    pending["message"] = self.get_commit_message(
+                        diffs, context, errors=pending["errors"]
+                    )
+            except Exception as err:
+                pending["errors"].append(f"Failed to generate commit message: {err}")
+
+        pending["thread"] = threading.Thread(target=generate, daemon=True)
+        pending["thread"].start()
+        return pending
+
+    def apply_commit_message(self, wait=True, timeout=None):
+        """
+        Reword the last background commit with its generated message. Returns
+        the old and new short hashes, or None if the commit was left alone.
+        """
+        pending = self.pending_message
+        if not pending:
+            return
+
+        thread = pending["thread"]
+        if wait:
+            thread.join(timeout)
+        if thread.is_alive():
+            if wait:
+                commit_hash = pending["hexsha"][:7]
+                self.io.tool_error(
+                    f"Commit message for {commit_hash} isn't ready, leaving its placeholder."
+                )
+            return
+
+        self.pending_message = None
+
+        for error in pending["errors"]:
+            self.io.tool_error(error)
+
+        commit_message = pending.get("message")
+        if not commit_message:
+            return
+
+        old_hash = pending["hexsha"][:7]
+        if self.repo.head.commit.hexsha != pending["hexsha"]:
+            self.io.tool_error(f"Commit {old_hash} is no longer HEAD, not rewording it.")
+            return
+
+        if pending["prefix"]:
+            commit_message = pending["prefix"] + commit_message
+
+        full_commit_message = commit_message
+        if pending["context"]:
+            full_commit_message += "\n\n# Aider chat conversation:\n\n" + pending["context"]
+
+        # --only leaves anything staged since out of the amended commit
+        self.repo.git.commit(["--amend", "--only", "-m", full_commit_message, "--no-verify"])
+        new_hash = self.repo.head.commit.hexsha[:7]
+        self.io.tool_output(f"Commit {old_hash} reworded as {new_hash} {commit_message}")
+
+        return old_hash, new_hash
+
     def get_rel_repo_dir(self):
         try:
             return os.path.relpath(self.repo.git_dir, os.getcwd())
         except ValueError:
             return self.repo.git_dir
 
-    def get_commit_message(self, diffs, context):
+    def get_commit_message(self, diffs, context, errors=None):
+        # errors are collected in the errors list if one is given, rather than
+        # shown, for when the message is generated in the background
+        tool_error = self.io.tool_error if errors is None else errors.append
+
         if len(diffs) >= 4 * 1024 * 4:
-            self.io.tool_error("Diff is too large to generate a commit message.")
+            tool_error("Diff is too large to generate a commit message.")
             return
 
         diffs = "# Diffs:\n" + diffs
@@ -124,7 +214,7 @@ class GitRepo:
                 break
 
         if not commit_message:
-            self.io.tool_error("Failed to generate commit message!")
+            tool_error("Failed to generate commit message!")
             return
 
         commit_message = commit_message.strip()
@@ -1,12 +1,20 @@
 import colorsys
+import hashlib
+import importlib.resources
 import os
 import random
 import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
 import networkx as nx
-import pkg_resources
 from diskcache import Cache
 from grep_ast import TreeContext, filename_to_lang
 from pygments.lexers import guess_lexer_for_filename
@@ -16,50 +24,285 @@ from tqdm import tqdm
 from tree_sitter_languages import get_language, get_parser
 
 from aider import models
+from aider.utils import LRUCache, count_tokens
 
 from .dump import dump  # noqa: F402
 
 Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
 
+# limits on the files worth parsing for tags, see check_parse_budget()
+ParseBudget = namedtuple("ParseBudget", "max_file_size max_line_length timeout".split())
+
+GENERATED_SUFFIXES = (".min.js", ".min.mjs", "_pb2.py", "_pb2_grpc.py", ".pb.go", ".pb.cc", ".pb.h")
+GENERATED_MARKERS = ("@generated", "do not edit")
+
+
+class RepoMapCancelled(Exception):
+    pass
+
+
+class ParseSkipped(Exception):
+    pass
+
+
+class TagTable:
+    """
+    The tags of one file, stored by column: each distinct name once, in sorted
+    order, with the defs and refs as arrays of name ids and line numbers.
+
+    Names are interned, so an identifier used across many files is only held
+    in memory once. The table holds no paths, so the same table is valid for
+    any copy of the file. Files which weren't parsed get an empty table, with
+    the reason in `skipped`.
+    """
+
+    __slots__ = ("names", "def_names", "def_lines", "ref_names", "ref_lines", "skipped")
+
+    def __init__(
+        self, names=(), def_names=(), def_lines=(), ref_names=(), ref_lines=(), skipped=None
+    ):
+        self.names = tuple(sys.intern(name) for name in names)
+        self.def_names = array("I", def_names)
+        self.def_lines = array("i", def_lines)
+        self.ref_names = array("I", ref_names)
+        self.ref_lines = array("i", ref_lines)
+        self.skipped = skipped
+
+    @classmethod
+    def from_tags(cls, tags):
+        tags = list(tags)
+
+        names = sorted(set(tag.name for tag in tags))
+        name_ids = dict((name, i) for i, name in enumerate(names))
+
+        defs = sorted(set((name_ids[tag.name], tag.line) for tag in tags if tag.kind == "def"))
+        refs = sorted((name_ids[tag.name], tag.line) for tag in tags if tag.kind == "ref")
+
+        return cls(
+            names,
+            [name_id for name_id, _line in defs],
+            [line for _name_id, line in defs],
+            [name_id for name_id, _line in refs],
+            [line for _name_id, line in refs],
+        )
+
+    def __getstate__(self):
+        return (
+            self.names,
+            self.def_names,
+            self.def_lines,
+            self.ref_names,
+            self.ref_lines,
+            self.skipped,
+        )
+
+    def __setstate__(self, state):
+        names, self.def_names, self.def_lines, self.ref_names, self.ref_lines, self.skipped = state
+        self.names = tuple(map(sys.intern, names))
+
+    def __eq__(self, other):
+        if not isinstance(other, TagTable):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __len__(self):
+        return len(self.def_names) + len(self.ref_names)
+
+    def get_def_names(self):
+        names = self.names
+        return set(names[name_id] for name_id in set(self.def_names))
+
+    def get_ref_counts(self):
+        names = self.names
+        return dict(
+            (names[name_id], num_refs) for name_id, num_refs in Counter(self.ref_names).items()
+        )
+
+    def get_def_lines(self, name):
+        # names and defs are both sorted, so this is two binary searches
+        name_id = bisect_left(self.names, name)
+        if name_id == len(self.names) or self.names[name_id] != name:
+            return []
+
+        start = bisect_left(self.def_names, name_id)
+        end = bisect_right(self.def_names, name_id)
+        return self.def_lines[start:end].tolist()
+
+    def get_tags(self, fname, rel_fname):
+        names = self.names
+        for name_id, line in zip(self.def_names, self.def_lines):
+            yield Tag(rel_fname=rel_fname, fname=fname, line=line, name=names[name_id], kind="def")
+        for name_id, line in zip(self.ref_names, self.ref_lines):
+            yield Tag(rel_fname=rel_fname, fname=fname, line=line, name=names[name_id], kind="ref")
+
 
 class RepoMap:
-    CACHE_VERSION = 3
+    CACHE_VERSION = 5
     TAGS_CACHE_DIR = f".aider.tags.cache.v{CACHE_VERSION}"
 
+    RENDER_CACHE_DIR = f".aider.render.cache.v{CACHE_VERSION}"
+
     cache_missing = False
+    SHARED_TAGS_CACHE = None
+    loaded_tags = None
+    pending_tags = None
+    RENDER_CACHE = None
 
     warned_files = set()
 
+    ranking_backends = ("networkx", "scipy")
+
+    # only fan tag extraction out to a process pool when this many files need parsing
+    parallel_min_files = 64
+
     def __init__(
         self,
         map_tokens=1024,
         root=None,
-        main_model=models.Model.strong_model(),
+        main_model=None,
         io=None,
         repo_content_prefix=None,
         verbose=False,
+        map_processes=None,
+        shared_cache_dir=None,
+        ranking="networkx",
+        render_cache=False,
+        watcher=None,
+        max_file_size=1024 * 1024,
+        max_line_length=5000,
+        parse_timeout=5.0,
     ):
         self.io = io
         self.verbose = verbose
+        self.watcher = watcher
+        self.watch_seq = None
+
+        if ranking not in self.ranking_backends:
+            raise ValueError(f"Unknown repo map ranking backend {ranking}")
+        self.ranking = ranking
+
+        if map_processes is None:
+            map_processes = os.cpu_count() or 1
+        self.map_processes = map_processes
+
+        self.parse_budget = ParseBudget(max_file_size, max_line_length, parse_timeout)
 
         if not root:
             root = os.getcwd()
         self.root = root
 
+        self.lock = threading.RLock()
+
         self.load_tags_cache()
+        self.reset_graph()
+        if shared_cache_dir:
+            self.load_shared_tags_cache(shared_cache_dir)
+
+        # rendered file outlines, keyed by file content and lines of interest
+        self.file_content_keys = dict()
+        self.content_keys = dict()
+        self.tree_contexts = LRUCache(64)
+        self.render_cache = LRUCache(8192)
+        self.map_blocks = LRUCache(8192)
+
+        # parse trees of recently parsed files, for incremental re-parsing
+        self.parse_trees = LRUCache(32)
+        if render_cache:
+            self.RENDER_CACHE = Cache(Path(self.root) / self.RENDER_CACHE_DIR)
 
         self.max_map_tokens = map_tokens
 
+        if not main_model:
+            main_model = models.Model.strong_model()
         self.tokenizer = main_model.tokenizer
         self.repo_content_prefix = repo_content_prefix
 
-    def get_repo_map(self, chat_files, other_files):
+    def reset_graph(self):
+        # reference graph state which persists between turns,
+        # see update_file_refs() and update_graph()
+        self.file_refs = dict()
+        self.defines = defaultdict(set)
+        self.references = defaultdict(Counter)
+        self.dirty_idents = set()
+
+        self.graph = nx.MultiDiGraph()
+        self.graph_edges = dict()
+        self.graph_refs_from_defines = False
+        self.last_ranked = dict()
+
+    cancelled = None
+    last_map_key = None
+    last_map = None
+    map_memo_hits = 0
+    map_memo_misses = 0
+
+    def get_repo_map(self, chat_files, other_files, cancelled=None):
         if self.max_map_tokens <= 0:
             return
 
         if not other_files:
             return
 
+        # the map may be built on a background thread, see Coder.repo_map_start()
+        with self.lock:
+            self.cancelled = cancelled
+            try:
+                return self.get_repo_map_memo(chat_files, other_files)
+            finally:
+                self.cancelled = None
+
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise RepoMapCancelled()
+
+    def get_repo_map_memo(self, chat_files, other_files):
+        # reuse the previous map if nothing it depends on has changed
+        map_key = self.get_repo_map_key(chat_files, other_files)
+        if map_key == self.last_map_key:
+            self.map_memo_hits += 1
+            if self.verbose:
+                self.io.tool_output(
+                    f"Repo-map: reused, {self.map_memo_hits} hits, {self.map_memo_misses} misses"
+                )
+            return self.last_map
+
+        self.map_memo_misses += 1
+
+        repo_content = self.build_repo_map(chat_files, other_files)
+
+        self.last_map_key = map_key
+        self.last_map = repo_content
+
+        return repo_content
+
+    def get_repo_map_key(self, chat_files, other_files):
+        fnames = set(chat_files).union(set(other_files))
+
+        if self.watcher:
+            return (
+                frozenset(chat_files),
+                frozenset(fnames),
+                self.watcher.last_change(fnames),
+                self.max_map_tokens,
+                self.tokenizer.name,
+            )
+
+        file_stats = []
+        for fname in sorted(fnames):
+            try:
+                stat = os.stat(fname)
+                file_stats.append((fname, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                file_stats.append((fname, None, None))
+
+        return (
+            frozenset(chat_files),
+            tuple(file_stats),
+            self.max_map_tokens,
+            self.tokenizer.name,
+        )
+
+    def build_repo_map(self, chat_files, other_files):
         files_listing = self.get_ranked_tags_map(chat_files, other_files)
         if not files_listing:
             return
@@ -83,7 +326,7 @@ class RepoMap:
         return repo_content
 
     def token_count(self, string):
-        return len(self.tokenizer.encode(string))
+        return count_tokens(self.tokenizer, string)
 
     def get_rel_fname(self, fname):
         return os.path.relpath(fname, self.root)
@@ -98,9 +341,43 @@ class RepoMap:
             self.cache_missing = True
         self.TAGS_CACHE = Cache(path)
 
+    def load_shared_tags_cache(self, shared_cache_dir):
+        # keyed by file content rather than path, so it can be shared across
+        # clones, worktrees and machines
+        path = Path(shared_cache_dir).expanduser() / f"tags.v{self.CACHE_VERSION}"
+        self.SHARED_TAGS_CACHE = Cache(path)
+
     def save_tags_cache(self):
         pass
 
+    def get_shared_cache_key(self, fname):
+        if self.SHARED_TAGS_CACHE is None:
+            return
+
+        lang = filename_to_lang(fname)
+        if not lang:
+            return
+
+        try:
+            content = Path(fname).read_bytes()
+        except OSError:
+            return
+
+        return f"{lang}:{git_blob_id(content)}"
+
+    def get_shared_tags(self, shared_key, fname, rel_fname):
+        if not shared_key:
+            return
+
+        return self.SHARED_TAGS_CACHE.get(shared_key)
+
+    def save_shared_tags(self, shared_key, data):
+        # skips depend on local settings and load, so aren't shared
+        if not shared_key or data.skipped:
+            return
+
+        self.SHARED_TAGS_CACHE[shared_key] = data
+
     def get_mtime(self, fname):
         try:
             return os.path.getmtime(fname)
@@ -108,179 +385,332 @@ class RepoMap:
             self.io.tool_error(f"File not found error: {fname}")
 
     def get_tags(self, fname, rel_fname):
-        # Check if the file is in the cache and if the modification time has not changed
-        file_mtime = self.get_mtime(fname)
+        return list(self.get_tag_table(fname, rel_fname).get_tags(fname, rel_fname))
+
+    def get_tag_table(self, fname, rel_fname, file_mtime=None):
         if file_mtime is None:
-            return []
+            file_mtime = self.get_mtime(fname)
+        if file_mtime is None:
+            return TagTable()
 
+        # Check if the file is in the cache and if the modification time has not changed
         cache_key = fname
-        if cache_key in self.TAGS_CACHE and self.TAGS_CACHE[cache_key]["mtime"] == file_mtime:
-            return self.TAGS_CACHE[cache_key]["data"]
+        if self.loaded_tags is not None and cache_key in self.loaded_tags:
+            cached = self.loaded_tags.pop(cache_key)
+        else:
+            cached = self.TAGS_CACHE.get(cache_key)
+        if cached is not None and cached["mtime"] == file_mtime:
+            return cached["data"]
 
         # miss!
 
-        data = list(self.get_tags_raw(fname, rel_fname))
+        shared_key = self.get_shared_cache_key(fname)
+        data = self.get_shared_tags(shared_key, fname, rel_fname)
+        if data is None:
+            try:
+                data = TagTable.from_tags(self.get_tags_raw(fname, rel_fname))
+            except ParseSkipped as err:
+                data = TagTable(skipped=str(err))
+                self.report_skipped(fname, data.skipped)
+            self.save_shared_tags(shared_key, data)
 
         # Update the cache
-        self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
-        self.save_tags_cache()
+        if self.pending_tags is not None:
+            self.pending_tags.append((fname, file_mtime, data))
+        else:
+            self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
+            self.save_tags_cache()
         return data
 
+    @contextmanager
+    def batch_tags_cache(self, fnames):
+        # Read the cache entries for fnames in one transaction up front, rather
+        # than a round trip per file, and write back the misses in one more.
+        self.loaded_tags = dict()
+        if fnames:
+            with self.TAGS_CACHE.transact():
+                for fname in fnames:
+                    cached = self.TAGS_CACHE.get(fname)
+                    if cached is not None:
+                        self.loaded_tags[fname] = cached
+
+        self.pending_tags = []
+        try:
+            yield
+        finally:
+            self.save_tags_batch(self.pending_tags)
+            self.loaded_tags = None
+            self.pending_tags = None
+
     def get_tags_raw(self, fname, rel_fname):
         lang = filename_to_lang(fname)
-        if not lang:
-            return
-
-        language = get_language(lang)
-        parser = get_parser(lang)
+        if not lang or not get_tags_query(lang):
+            return []
 
-        # Load the tags queries
-        scm_fname = pkg_resources.resource_filename(
-            __name__, os.path.join("queries", f"tree-sitter-{lang}-tags.scm")
-        )
-        query_scm = Path(scm_fname)
-        if not query_scm.exists():
-            return
-        query_scm = query_scm.read_text()
+        check_parse_budget(fname, self.parse_budget)
 
         code = self.io.read_text(fname)
         if not code:
-            return
-        tree = parser.parse(bytes(code, "utf-8"))
+            return []
 
-        # Run the tags queries
-        query = language.query(query_scm)
-        captures = query.captures(tree.root_node)
+        check_parse_budget(fname, self.parse_budget, code)
+
+        tree = self.parse_code(fname, lang, code)
+        return get_tags_raw(fname, rel_fname, code, tree, self.parse_budget.timeout)
+
+    def parse_code(self, fname, lang, code):
+        # The tree is kept, so that when aider edits the file, the new content
+        # can be parsed incrementally, see update_file().
+        parser, _query = get_tags_query(lang)
+        code = bytes(code, "utf-8")
+
+        old_tree = None
+        old = self.parse_trees.pop(fname)
+        if old:
+            old_code, old_tree = old
+            old_tree.edit(**get_tree_edit(old_code, code))
+
+        tree = parse_tree(parser, code, old_tree, self.parse_budget.timeout)
+
+        self.parse_trees.put(fname, (code, tree))
+        return tree
+
+    def update_file(self, fname, content):
+        # Called after aider writes a file, to update its cache entries from
+        # the new content rather than re-reading and re-parsing it next turn.
+        with self.lock:
+            file_mtime = self.get_mtime(fname)
+            if file_mtime is None:
+                return
+
+            lang = filename_to_lang(fname)
+            data = TagTable()
+            if lang and get_tags_query(lang) and content:
+                rel_fname = self.get_rel_fname(fname)
+                try:
+                    check_parse_budget(fname, self.parse_budget, content)
+                    tree = self.parse_code(fname, lang, content)
+                    tags = get_tags_raw(fname, rel_fname, content, tree, self.parse_budget.timeout)
+                    data = TagTable.from_tags(tags)
+                except ParseSkipped as err:
+                    data = TagTable(skipped=str(err))
+                    self.report_skipped(fname, data.skipped)
+            self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
+
+            content_key = self.get_content_hash(fname, content or "")
+            self.file_content_keys[fname] = (file_mtime, content_key)
+
+    def report_skipped(self, fname, reason):
+        if self.verbose:
+            self.io.tool_output(f"Repo-map: skipped {self.get_rel_fname(fname)}, {reason}")
 
-        captures = list(captures)
+    def prefetch_tags(self, fnames):
+        if self.map_processes <= 1:
+            return
 
-        saw = set()
-        for node, tag in captures:
-            if tag.startswith("name.definition."):
-                kind = "def"
-            elif tag.startswith("name.reference."):
-                kind = "ref"
-            else:
+        todo = []
+        for fname in fnames:
+            lang = filename_to_lang(fname)
+            if not lang or not get_tags_query(lang) or not Path(fname).is_file():
                 continue
+            file_mtime = self.get_mtime(fname)
+            if file_mtime is None:
+                continue
+            cached = self.TAGS_CACHE.get(fname)
+            if cached is not None and cached["mtime"] == file_mtime:
+                continue
+            todo.append((fname, self.get_rel_fname(fname), file_mtime))
 
-            saw.add(kind)
-
-            result = Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=node.text.decode("utf-8"),
-                kind=kind,
-                line=node.start_point[0],
-            )
-
-            yield result
+        shared_keys = dict()
+        if self.SHARED_TAGS_CACHE is not None:
+            todo, shared_keys = self.prefetch_shared_tags(todo)
 
-        if "ref" in saw:
+        if len(todo) < self.parallel_min_files:
             return
-        if "def" not in saw:
-            return
-
-        # We saw defs, without any refs
-        # Some tags files only provide defs (cpp, for example)
-        # Use pygments to backfill refs
 
-        try:
-            lexer = guess_lexer_for_filename(fname, code)
-        except ClassNotFound:
-            return
+        num_processes = min(self.map_processes, len(todo))
+        chunksize = max(1, min(32, len(todo) // (num_processes * 4)))
+        mtimes = dict((fname, file_mtime) for fname, _rel_fname, file_mtime in todo)
+        jobs = [
+            (fname, rel_fname, self.io.encoding, self.parse_budget)
+            for fname, rel_fname, _mtime in todo
+        ]
+
+        start = time.time()
+        num_parsed = 0
+        num_skipped = 0
+        batch = []
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            results = executor.map(get_tags_worker, jobs, chunksize=chunksize)
+            for fname, data in tqdm(results, total=len(jobs)):
+                # unreadable files are left for get_tags() to report
+                if data is None:
+                    continue
+                if data.skipped:
+                    num_skipped += 1
+                    self.report_skipped(fname, data.skipped)
+                batch.append((fname, mtimes[fname], data))
+                if len(batch) >= 256:
+                    num_parsed += self.save_tags_batch(batch, shared_keys)
+                    batch = []
+
+        num_parsed += self.save_tags_batch(batch, shared_keys)
+
+        elapsed = time.time() - start
+        rate = num_parsed / elapsed if elapsed > 0 else 0
+        self.io.tool_output(
+            f"Repo-map: parsed {num_parsed} files in {elapsed:.1f} sec with"
+            f" {num_processes} processes, {rate:.0f} files/sec"
+        )
+        if num_skipped:
+            self.io.tool_output(
+                f"Repo-map: skipped {num_skipped} large, minified or generated files"
+            )
 
-        tokens = list(lexer.get_tokens(code))
-        tokens = [token[1] for token in tokens if token[0] in Token.Name]
+    def prefetch_shared_tags(self, todo):
+        misses = []
+        hits = []
+        shared_keys = dict()
+        for fname, rel_fname, file_mtime in todo:
+            shared_key = self.get_shared_cache_key(fname)
+            data = self.get_shared_tags(shared_key, fname, rel_fname)
+            if data is None:
+                misses.append((fname, rel_fname, file_mtime))
+                shared_keys[fname] = shared_key
+            else:
+                hits.append((fname, file_mtime, data))
 
-        for token in tokens:
-            yield Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=token,
-                kind="ref",
-                line=-1,
-            )
+        self.save_tags_batch(hits)
 
-    def get_ranked_tags(self, chat_fnames, other_fnames):
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
+        return misses, shared_keys
 
-        personalization = dict()
+    def save_tags_batch(self, batch, shared_keys=None):
+        if not batch:
+            return 0
 
-        fnames = set(chat_fnames).union(set(other_fnames))
-        chat_rel_fnames = set()
+        with self.TAGS_CACHE.transact():
+            for fname, file_mtime, data in batch:
+                self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
 
-        fnames = sorted(fnames)
+        if shared_keys:
+            with self.SHARED_TAGS_CACHE.transact():
+                for fname, _mtime, data in batch:
+                    self.save_shared_tags(shared_keys.get(fname), data)
 
-        if self.cache_missing:
-            fnames = tqdm(fnames)
-        self.cache_missing = False
+        return len(batch)
 
-        for fname in fnames:
-            if not Path(fname).is_file():
-                if fname not in self.warned_files:
-                    if Path(fname).exists():
-                        self.io.tool_error(
-                            f"Repo-map can't include {fname}, it is not a normal file"
-                        )
-                    else:
-                        self.io.tool_error(f"Repo-map can't include {fname}, it no longer exists")
-
-                self.warned_files.add(fname)
-                continue
+    def update_file_refs(self, fname, rel_fname):
+        file_mtime = self.get_mtime(fname)
+        old = self.file_refs.get(rel_fname)
+        if old and file_mtime is not None and old[0] == file_mtime:
+            return
 
-            # dump(fname)
-            rel_fname = self.get_rel_fname(fname)
+        table = self.get_tag_table(fname, rel_fname, file_mtime)
 
-            if fname in chat_fnames:
-                personalization[rel_fname] = 1.0
-                chat_rel_fnames.add(rel_fname)
+        if old and old[1] == table:
+            self.file_refs[rel_fname] = (file_mtime, old[1], fname)
+            return
 
-            tags = list(self.get_tags(fname, rel_fname))
-            if tags is None:
-                continue
+        self.remove_file_refs(rel_fname)
 
-            for tag in tags:
-                if tag.kind == "def":
-                    defines[tag.name].add(rel_fname)
-                    key = (rel_fname, tag.name)
-                    definitions[key].add(tag)
+        file_defs = table.get_def_names()
+        file_refs = table.get_ref_counts()
 
-                if tag.kind == "ref":
-                    references[tag.name].append(rel_fname)
+        for ident in file_defs:
+            self.defines[ident].add(rel_fname)
+        for ident, num_refs in file_refs.items():
+            self.references[ident][rel_fname] = num_refs
 
-        ##
-        # dump(defines)
-        # dump(references)
+        self.file_refs[rel_fname] = (file_mtime, table, fname)
+        self.dirty_idents.update(file_defs)
+        self.dirty_idents.update(file_refs)
 
-        if not references:
-            references = dict((k, list(v)) for k, v in defines.items())
+    def remove_file_refs(self, rel_fname):
+        old = self.file_refs.pop(rel_fname, None)
+        if not old:
+            return
 
-        idents = set(defines.keys()).intersection(set(references.keys()))
+        _mtime, table, _fname = old
+        file_defs = table.get_def_names()
+        file_refs = table.get_ref_counts()
+
+        for ident in file_defs:
+            self.defines[ident].discard(rel_fname)
+            if not self.defines[ident]:
+                del self.defines[ident]
+
+        for ident in file_refs:
+            self.references[ident].pop(rel_fname, None)
+            if not self.references[ident]:
+                del self.references[ident]
+
+        self.dirty_idents.update(file_defs)
+        self.dirty_idents.update(file_refs)
+
+    def update_graph(self):
+        # Edges are keyed by ident, so only the edges of idents which were
+        # defined or referenced by a changed file need to be rebuilt.
+
+        # if nothing references anything, use the definitions as references
+        refs_from_defines = not self.references
+        if refs_from_defines != self.graph_refs_from_defines:
+            self.graph_refs_from_defines = refs_from_defines
+            self.dirty_idents.update(self.graph_edges)
+            self.dirty_idents.update(self.defines)
+
+        G = self.graph
+        touched = set()
+
+        for ident in self.dirty_idents:
+            for referencer, definer in self.graph_edges.pop(ident, []):
+                G.remove_edge(referencer, definer, key=ident)
+                touched.add(referencer)
+                touched.add(definer)
+
+            definers = self.defines.get(ident)
+            if not definers:
+                continue
 
-        G = nx.MultiDiGraph()
+            if refs_from_defines:
+                references = Counter(definers)
+            else:
+                references = self.references.get(ident)
+            if not references:
+                continue
 
-        for ident in idents:
-            definers = defines[ident]
-            for referencer, num_refs in Counter(references[ident]).items():
+            edges = []
+            for referencer, num_refs in references.items():
                 for definer in definers:
                     # if referencer == definer:
                     #    continue
-                    G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+                    G.add_edge(referencer, definer, key=ident, weight=num_refs, ident=ident)
+                    edges.append((referencer, definer))
+            self.graph_edges[ident] = edges
+
+        for node in touched:
+            if node in G and not G.degree(node):
+                G.remove_node(node)
+
+        self.dirty_idents = set()
 
-        if not references:
-            pass
+    def rank_networkx(self, personalization):
+        self.update_graph()
+        G = self.graph
 
         if personalization:
             pers_args = dict(personalization=personalization, dangling=personalization)
         else:
             pers_args = dict()
 
+        # warm start from the previous turn's ranks, most of the graph is unchanged
+        nstart = dict((node, self.last_ranked.get(node, 0)) for node in G)
+        if sum(nstart.values()) > 0:
+            pers_args["nstart"] = nstart
+
         try:
             ranked = nx.pagerank(G, weight="weight", **pers_args)
         except ZeroDivisionError:
-            return []
+            return
 
         # distribute the rank from each source node, across all of its out edges
         ranked_definitions = defaultdict(float)
@@ -289,20 +719,187 @@ class RepoMap:
             total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
             # dump(src, src_rank, total_weight)
             for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
+                rank = src_rank * data["weight"] / total_weight
                 ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
+                ranked_definitions[(dst, ident)] += rank
+
+        return ranked, ranked_definitions
+
+    def rank_sparse(self, personalization):
+        # Same ranking as rank_networkx(), but with files and idents mapped to
+        # integer ids and the graph held as arrays instead of networkx edges.
+        import numpy as np
+
+        self.dirty_idents = set()
+
+        refs_from_defines = not self.references
+
+        file_ids = dict()
+        ident_names = []
+        src = []
+        dst = []
+        weights = []
+        edge_idents = []
+
+        for ident, definers in self.defines.items():
+            if refs_from_defines:
+                references = Counter(definers)
+            else:
+                references = self.references.get(ident)
+                if not references:
+                    continue
+
+            ident_id = len(ident_names)
+            ident_names.append(ident)
+
+            definer_ids = [file_ids.setdefault(definer, len(file_ids)) for definer in definers]
+            for referencer, num_refs in references.items():
+                referencer_id = file_ids.setdefault(referencer, len(file_ids))
+                for definer_id in definer_ids:
+                    src.append(referencer_id)
+                    dst.append(definer_id)
+                    weights.append(num_refs)
+                    edge_idents.append(ident_id)
+
+        nodelist = list(file_ids)
+        num_nodes = len(nodelist)
+        if not num_nodes:
+            return dict(), dict()
+
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        weights = np.array(weights, dtype=float)
+        edge_idents = np.array(edge_idents, dtype=np.int64)
+
+        if personalization:
+            pers = np.array([personalization.get(node, 0) for node in nodelist], dtype=float)
+        else:
+            pers = None
+
+        nstart = np.array([self.last_ranked.get(node, 0) for node in nodelist], dtype=float)
+        if not nstart.sum() > 0:
+            nstart = None
+
+        try:
+            ranks = pagerank_sparse(num_nodes, src, dst, weights, pers, nstart)
+        except ZeroDivisionError:
+            return
+
+        ranked = dict(zip(nodelist, map(float, ranks)))
+
+        # distribute the rank from each source node, across all of its out edges
+        out_weights = np.bincount(src, weights=weights, minlength=num_nodes)
+        edge_ranks = ranks[src] * weights / out_weights[src]
+
+        num_idents = len(ident_names)
+        keys, inverse = np.unique(dst * num_idents + edge_idents, return_inverse=True)
+        totals = np.bincount(inverse, weights=edge_ranks)
+
+        ranked_definitions = dict()
+        for key, total in zip(keys.tolist(), totals.tolist()):
+            node_id, ident_id = divmod(key, num_idents)
+            ranked_definitions[(nodelist[node_id], ident_names[ident_id])] = total
+
+        return ranked, ranked_definitions
+
+    def get_ranked_tags(self, chat_fnames, other_fnames):
+        personalization = dict()
+
+        fnames = set(chat_fnames).union(set(other_fnames))
+        chat_rel_fnames = set()
+
+        fnames = sorted(fnames)
+
+        # a fresh graph needs the cached tags of every file, so read them in bulk
+        load_fnames = fnames if not self.file_refs else []
+
+        if self.cache_missing:
+            self.prefetch_tags(fnames)
+            fnames = tqdm(fnames)
+        self.cache_missing = False
+
+        # with a file watcher, only files which changed since the last turn need a stat
+        # watch_seq only moves on once every changed file has been re-read, so
+        # files a cancelled or failed pass didn't reach are re-checked next time
+        changed = None
+        watch_seq = None
+        if self.watcher:
+            changed, watch_seq = self.watcher.get_changes(self.watch_seq)
+            if changed is None:
+                self.file_content_keys = dict()
+            else:
+                for fname in changed:
+                    self.file_content_keys.pop(fname, None)
+
+        rel_fnames = set()
+        with self.batch_tags_cache(load_fnames):
+            for fname in fnames:
+                self.check_cancelled()
+
+                rel_fname = sys.intern(self.get_rel_fname(fname))
+                unchanged = (
+                    changed is not None and fname not in changed and rel_fname in self.file_refs
+                )
+
+                if not unchanged and not Path(fname).is_file():
+                    if fname not in self.warned_files:
+                        if Path(fname).exists():
+                            self.io.tool_error(
+                                f"Repo-map can't include {fname}, it is not a normal file"
+                            )
+                        else:
+                            self.io.tool_error(
+                                f"Repo-map can't include {fname}, it no longer exists"
+                            )
+
+                    self.warned_files.add(fname)
+                    continue
+
+                # dump(fname)
+                rel_fnames.add(rel_fname)
+
+                if fname in chat_fnames:
+                    personalization[rel_fname] = 1.0
+                    chat_rel_fnames.add(rel_fname)
+
+                if not unchanged:
+                    self.update_file_refs(fname, rel_fname)
+
+        for rel_fname in set(self.file_refs) - rel_fnames:
+            self.remove_file_refs(rel_fname)
+
+        if self.watcher:
+            self.watch_seq = watch_seq
+
+        ##
+        # dump(self.defines)
+        # dump(self.references)
+
+        if self.ranking == "scipy":
+            res = self.rank_sparse(personalization)
+        else:
+            res = self.rank_networkx(personalization)
+
+        if res is None:
+            return []
+
+        ranked, ranked_definitions = res
+        self.last_ranked = ranked
 
         ranked_tags = []
         ranked_definitions = sorted(ranked_definitions.items(), reverse=True, key=lambda x: x[1])
 
         # dump(ranked_definitions)
 
-        for (fname, ident), rank in ranked_definitions:
-            # print(f"{rank:.03f} {fname} {ident}")
-            if fname in chat_rel_fnames:
+        for (rel_fname, ident), rank in ranked_definitions:
+            # print(f"{rank:.03f} {rel_fname} {ident}")
+            if rel_fname in chat_rel_fnames:
                 continue
-            ranked_tags += list(definitions.get((fname, ident), []))
+            _mtime, table, fname = self.file_refs[rel_fname]
+            for line in table.get_def_lines(ident):
+                ranked_tags.append(
+                    Tag(rel_fname=rel_fname, fname=fname, line=line, name=ident, kind="def")
+                )
 
         rel_other_fnames_without_tags = set(self.get_rel_fname(fname) for fname in other_fnames)
 
@@ -325,76 +922,430 @@ class RepoMap:
             other_fnames = list()
 
         ranked_tags = self.get_ranked_tags(chat_fnames, other_fnames)
+
+        chat_rel_fnames = set(self.get_rel_fname(fname) for fname in chat_fnames)
+        ranked_tags = [tag for tag in ranked_tags if tag[0] not in chat_rel_fnames]
+
         num_tags = len(ranked_tags)
 
         lower_bound = 0
         upper_bound = num_tags
         best_tree = None
 
-        chat_rel_fnames = [self.get_rel_fname(fname) for fname in chat_fnames]
+        # Each file's block is rendered and token counted once per set of lines of
+        # interest, and a probe's size is the sum of its blocks' counts. Successive
+        # probes only differ in the files with tags between them, so the total
+        # rendering work is linear in the number of tags.
+        self.content_keys = dict()
 
         while lower_bound <= upper_bound:
+            self.check_cancelled()
+
             middle = (lower_bound + upper_bound) // 2
-            tree = self.to_tree(ranked_tags[:middle], chat_rel_fnames)
-            num_tokens = self.token_count(tree)
+            blocks = self.get_map_blocks(ranked_tags[:middle])
+            num_tokens = sum(tokens for _block, tokens in blocks)
 
             if num_tokens < self.max_map_tokens:
-                best_tree = tree
+                best_tree = "".join(block for block, _tokens in blocks)
                 lower_bound = middle + 1
             else:
                 upper_bound = middle - 1
 
         return best_tree
 
+    def get_map_blocks(self, tags):
+        files = dict()
+        for tag in tags:
+            rel_fname = tag[0]
+            if rel_fname not in files:
+                files[rel_fname] = [None, set()]
+            if type(tag) is Tag:
+                files[rel_fname][0] = tag.fname
+                files[rel_fname][1].add(tag.line)
+
+        blocks = []
+        for rel_fname in sorted(files):
+            fname, lois = files[rel_fname]
+            content_key = self.get_content_key(fname) if fname else None
+            key = (rel_fname, content_key, frozenset(lois))
+            block = self.map_blocks.get(key)
+            if block is None:
+                text = self.render_block(rel_fname, fname, lois, content_key)
+                block = (text, self.token_count(text))
+                self.map_blocks.put(key, block)
+            blocks.append(block)
+
+        return blocks
+
+    def get_content_key(self, fname):
+        content_key = self.content_keys.get(fname)
+        if content_key:
+            return content_key
+
+        memo = self.file_content_keys.get(fname)
+
+        # the watcher already dropped the memos of changed files
+        if memo and self.watcher:
+            self.content_keys[fname] = memo[1]
+            return memo[1]
+
+        # only re-read and re-hash files whose mtime has changed
+        file_mtime = self.get_mtime(fname)
+        if memo and file_mtime is not None and memo[0] == file_mtime:
+            content_key = memo[1]
+        else:
+            code = self.io.read_text(fname) or ""
+            content_key = self.get_content_hash(fname, code)
+            self.file_content_keys[fname] = (file_mtime, content_key)
+
+        self.content_keys[fname] = content_key
+        return content_key
+
+    def get_content_hash(self, fname, code):
+        lang = filename_to_lang(fname) or ""
+        return hashlib.sha1(f"{lang}\0{code}".encode("utf-8")).hexdigest()
+
+    def render_block(self, rel_fname, fname, lois, content_key=None):
+        if not fname:
+            return "\n" + rel_fname + "\n"
+
+        if not content_key:
+            content_key = self.get_content_key(fname)
+
+        render_key = (content_key, tuple(sorted(lois)))
+        skeleton = self.render_cache.get(render_key)
+        if skeleton is None and self.RENDER_CACHE is not None:
+            skeleton = self.RENDER_CACHE.get(render_key)
+
+        if skeleton is None:
+            context = self.get_tree_context(rel_fname, fname, content_key)
+
+            # the context is reused for each set of lines of interest
+            context.lines_of_interest = set(lois)
+            context.show_lines = set()
+            context.add_context()
+            skeleton = context.format()
+
+            if self.RENDER_CACHE is not None:
+                self.RENDER_CACHE[render_key] = skeleton
+
+        self.render_cache.put(render_key, skeleton)
+
+        return "\n" + rel_fname + ":\n" + skeleton
+
+    def get_tree_context(self, rel_fname, fname, content_key):
+        context = self.tree_contexts.get(content_key)
+        if context:
+            return context
+
+        code = self.io.read_text(fname) or ""
+        context = TreeContext(
+            rel_fname,
+            code,
+            color=False,
+            line_number=False,
+            child_context=False,
+            last_line=False,
+            margin=0,
+            mark_lois=False,
+            loi_pad=0,
+            # header_max=30,
+            show_top_of_file_parent_scope=False,
+        )
+        self.tree_contexts.put(content_key, context)
+
+        return context
+
     def to_tree(self, tags, chat_rel_fnames):
         if not tags:
             return ""
 
         tags = [tag for tag in tags if tag[0] not in chat_rel_fnames]
-        tags = sorted(tags)
-
-        cur_fname = None
-        context = None
-        output = ""
-
-        # add a bogus tag at the end so we trip the this_fname != cur_fname...
-        dummy_tag = (None,)
-        for tag in tags + [dummy_tag]:
-            this_rel_fname = tag[0]
-
-            # ... here ... to output the final real entry in the list
-            if this_rel_fname != cur_fname:
-                if context:
-                    context.add_context()
-                    output += "\n"
-                    output += cur_fname + ":\n"
-                    output += context.format()
-                    context = None
-                elif cur_fname:
-                    output += "\n" + cur_fname + "\n"
-
-                if type(tag) is Tag:
-                    code = self.io.read_text(tag.fname) or ""
-
-                    context = TreeContext(
-                        tag.rel_fname,
-                        code,
-                        color=False,
-                        line_number=False,
-                        child_context=False,
-                        last_line=False,
-                        margin=0,
-                        mark_lois=False,
-                        loi_pad=0,
-                        # header_max=30,
-                        show_top_of_file_parent_scope=False,
-                    )
-                cur_fname = this_rel_fname
-
-            if context:
-                context.add_lines_of_interest([tag.line])
-
-        return output
+
+        self.content_keys = dict()
+        blocks = self.get_map_blocks(tags)
+
+        return "".join(block for block, _tokens in blocks)
+
+
+@lru_cache(maxsize=None)
+def get_tags_query(lang):
+    # Load and compile the tags queries once per language, per process
+    query_scm = importlib.resources.files("aider") / "queries" / f"tree-sitter-{lang}-tags.scm"
+    if not query_scm.is_file():
+        return
+
+    language = get_language(lang)
+    parser = get_parser(lang)
+    query = language.query(query_scm.read_text())
+
+    return parser, query
+
+
+def check_parse_budget(fname, budget, code=None):
+    # Raises ParseSkipped for files not worth parsing: ones which are too big,
+    # minified or generated. Without code, only checks what a stat can.
+    if code is None:
+        try:
+            size = os.path.getsize(fname)
+        except OSError:
+            return
+    else:
+        size = len(code)
+
+    if budget.max_file_size and size > budget.max_file_size:
+        raise ParseSkipped(f"larger than {budget.max_file_size} bytes")
+
+    if fname.endswith(GENERATED_SUFFIXES):
+        raise ParseSkipped("generated file")
+
+    if code is None:
+        return
+
+    lines = code.splitlines()
+    if budget.max_line_length and max(map(len, lines), default=0) > budget.max_line_length:
+        raise ParseSkipped(f"has lines over {budget.max_line_length} characters, minified?")
+
+    header = "\n".join(lines[:5]).lower()
+    if any(marker in header for marker in GENERATED_MARKERS):
+        raise ParseSkipped("generated file")
+
+
+def parse_tree(parser, code, old_tree=None, timeout=None):
+    parser.set_timeout_micros(int(timeout * 1000000) if timeout else 0)
+    try:
+        if old_tree:
+            return parser.parse(code, old_tree)
+        return parser.parse(code)
+    except ValueError:
+        # otherwise the parser resumes this parse, on the next call
+        parser.reset()
+        raise ParseSkipped(f"parsing took over {timeout:g} sec")
+
+
+def get_tags_raw(fname, rel_fname, code, tree=None, timeout=None):
+    lang = filename_to_lang(fname)
+    if not lang:
+        return
+
+    tags_query = get_tags_query(lang)
+    if not tags_query:
+        return
+    parser, query = tags_query
+
+    if not code:
+        return
+    if tree is None:
+        tree = parse_tree(parser, bytes(code, "utf-8"), timeout=timeout)
+
+    # Run the tags queries
+    captures = query.captures(tree.root_node)
+
+    captures = list(captures)
+
+    saw = set()
+    for node, tag in captures:
+        if tag.startswith("name.definition."):
+            kind = "def"
+        elif tag.startswith("name.reference."):
+            kind = "ref"
+        else:
+            continue
+
+        saw.add(kind)
+
+        result = Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=node.text.decode("utf-8"),
+            kind=kind,
+            line=node.start_point[0],
+        )
+
+        yield result
+
+    if "ref" in saw:
+        return
+    if "def" not in saw:
+        return
+
+    # We saw defs, without any refs
+    # Some tags files only provide defs (cpp, for example)
+    # Use the identifiers in the tree to backfill refs, or pygments for
+    # grammars without identifier nodes
+
+    identifiers_query = get_identifiers_query(lang)
+    if identifiers_query:
+        refs = get_identifier_refs(identifiers_query, tree)
+    else:
+        refs = get_pygments_refs(fname, code, timeout)
+
+    for name, line in refs:
+        yield Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=name,
+            kind="ref",
+            line=line,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_identifiers_query(lang):
+    # A query for every kind of identifier node in the grammar
+    language = get_language(lang)
+
+    kinds = set()
+    for kind_id in range(language.node_kind_count):
+        if not language.node_kind_is_named(kind_id) or not language.node_kind_is_visible(kind_id):
+            continue
+        kind = language.node_kind_for_id(kind_id)
+        if kind.endswith("identifier"):
+            kinds.add(kind)
+
+    if not kinds:
+        return
+
+    patterns = " ".join(f"({kind})" for kind in sorted(kinds))
+    return language.query(f"[{patterns}] @name")
+
+
+def get_identifier_refs(query, tree):
+    refs = []
+    for node, _tag in query.captures(tree.root_node):
+        # skip qualified names like a::b, their parts are captured on their own
+        if node.named_child_count:
+            continue
+        name = node.text.decode("utf-8")
+        # missing nodes inserted by error recovery are empty
+        if name:
+            refs.append((name, node.start_point[0]))
+    return refs
+
+
+def get_pygments_refs(fname, code, timeout=None):
+    try:
+        lexer = guess_lexer_for_filename(fname, code)
+    except ClassNotFound:
+        return []
+
+    deadline = time.time() + timeout if timeout else None
+    refs = []
+    for i, (token_type, text) in enumerate(lexer.get_tokens(code)):
+        if deadline and i % 1000 == 0 and time.time() > deadline:
+            raise ParseSkipped(f"lexing took over {timeout:g} sec")
+        if token_type in Token.Name:
+            refs.append((text, -1))
+    return refs
+
+
+def get_tree_edit(old, new):
+    # The single edit which turns the old bytes into the new, found from their
+    # common prefix and suffix, in the form tree-sitter's Tree.edit() takes.
+    size = min(len(old), len(new))
+
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    start = lo
+
+    lo, hi = 0, size - start
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid :] == new[len(new) - mid :]:
+            lo = mid
+        else:
+            hi = mid - 1
+    old_end = len(old) - lo
+    new_end = len(new) - lo
+
+    return dict(
+        start_byte=start,
+        old_end_byte=old_end,
+        new_end_byte=new_end,
+        start_point=get_point(old, start),
+        old_end_point=get_point(old, old_end),
+        new_end_point=get_point(new, new_end),
+    )
+
+
+def get_point(code, byte):
+    row = code.count(b"\n", 0, byte)
+    column = byte - (code.rfind(b"\n", 0, byte) + 1)
+    return (row, column)
+
+
+def pagerank_sparse(
+    num_nodes,
+    src,
+    dst,
+    weights,
+    personalization=None,
+    nstart=None,
+    alpha=0.85,
+    max_iter=100,
+    tol=1e-06,
+):
+    # Personalized PageRank with the personalization vector also used for
+    # dangling nodes, following networkx's scipy implementation so the two
+    # backends rank identically. Parallel edges have their weights summed.
+    import numpy as np
+    from scipy import sparse
+
+    A = sparse.csr_array((weights, (src, dst)), shape=(num_nodes, num_nodes), dtype=float)
+    S = A.sum(axis=1)
+    S[S != 0] = 1.0 / S[S != 0]
+    Q = sparse.csr_array(sparse.spdiags(S.T, 0, *A.shape))
+    A = Q @ A
+
+    if nstart is None:
+        x = np.repeat(1.0 / num_nodes, num_nodes)
+    else:
+        x = nstart / nstart.sum()
+
+    if personalization is None:
+        p = np.repeat(1.0 / num_nodes, num_nodes)
+    else:
+        if personalization.sum() == 0:
+            raise ZeroDivisionError
+        p = personalization / personalization.sum()
+
+    is_dangling = np.where(S == 0)[0]
+
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (x @ A + sum(x[is_dangling]) * p) + (1 - alpha) * p
+        err = np.absolute(x - xlast).sum()
+        if err < num_nodes * tol:
+            return x
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def git_blob_id(content):
+    # the same id git stores in the index and object db for this content
+    header = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def get_tags_worker(job):
+    fname, rel_fname, encoding, budget = job
+    try:
+        check_parse_budget(fname, budget)
+        with open(fname, "r", encoding=encoding) as f:
+            code = f.read()
+        check_parse_budget(fname, budget, code)
+
+        tags = get_tags_raw(fname, rel_fname, code, timeout=budget.timeout)
+        return fname, TagTable.from_tags(tags)
+    except ParseSkipped as err:
+        return fname, TagTable(skipped=str(err))
+    except (OSError, UnicodeError):
+        return fname, None
 
 
 def find_src_files(directory):
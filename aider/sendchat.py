@@ -1,18 +1,57 @@
 import hashlib
 import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
 
 import backoff
 import httpx
 import openai
-
-# from diskcache import Cache
+from diskcache import Cache
 from openai import APIConnectionError, InternalServerError, RateLimitError
 
 from aider.dump import dump  # noqa: F401
 
 CACHE_PATH = "~/.aider.send.cache.v1"
 CACHE = None
-# CACHE = Cache(CACHE_PATH)
+CACHE_MAX_AGE = None
+
+# an aider.replay.Recorder, to save every completion
+RECORDER = None
+
+# retry notices are printed, unless redirected for this thread, see retry_output()
+retry_notices = threading.local()
+
+
+def enable_cache(path=CACHE_PATH, size_limit=1024 * 1024 * 1024, max_age=None):
+    # Responses are keyed by a hash of the request. Once the cache is over
+    # size_limit bytes the least recently used are evicted, and any older
+    # than max_age seconds expire. A max_age of 0 means no limit, as
+    # diskcache would treat it as already expired.
+    global CACHE, CACHE_MAX_AGE
+
+    CACHE = Cache(
+        str(Path(path).expanduser()),
+        size_limit=size_limit,
+        eviction_policy="least-recently-used",
+    )
+    CACHE_MAX_AGE = max_age or None
+
+
+def report_backoff(details):
+    output = getattr(retry_notices, "output", None) or print
+    output(f"{details.get('exception','Exception')}\nRetry in {details['wait']:.1f} seconds.")
+
+
+@contextmanager
+def retry_output(output):
+    # for background threads, which mustn't print over the user's prompt
+    retry_notices.output = output
+    try:
+        yield
+    finally:
+        retry_notices.output = None
 
 
 @backoff.on_exception(
@@ -24,9 +63,7 @@ CACHE = None
         httpx.ConnectError,
     ),
     max_tries=10,
-    on_backoff=lambda details: print(
-        f"{details.get('exception','Exception')}\nRetry in {details['wait']:.1f} seconds."
-    ),
+    on_backoff=report_backoff,
 )
 def send_with_retries(client, model_name, messages, functions, stream):
     if not client:
@@ -41,22 +78,51 @@ def send_with_retries(client, model_name, messages, functions, stream):
     if functions is not None:
         kwargs["functions"] = functions
 
-    key = json.dumps(kwargs, sort_keys=True).encode()
-
     # Generate SHA1 hash of kwargs and append it to chat_completion_call_hashes
-    hash_object = hashlib.sha1(key)
+    hash_object = get_request_hash(kwargs)
 
-    if not stream and CACHE is not None and key in CACHE:
-        return hash_object, CACHE[key]
+    start = time.perf_counter()
+
+    if CACHE is not None:
+        cached = CACHE.get(hash_object.hexdigest())
+        if cached is not None:
+            res = iter(cached) if stream else cached
+            # so a recording made with the cache on is still complete, though
+            # cached chunks are recorded as arriving without any delay
+            if RECORDER is not None:
+                res = RECORDER.record(hash_object.hexdigest(), kwargs, res, start)
+            return hash_object, res
 
     res = client.chat.completions.create(**kwargs)
 
-    if not stream and CACHE is not None:
-        CACHE[key] = res
+    if RECORDER is not None:
+        res = RECORDER.record(hash_object.hexdigest(), kwargs, res, start)
+
+    if CACHE is not None:
+        if stream:
+            res = cache_stream(hash_object.hexdigest(), res)
+        else:
+            CACHE.set(hash_object.hexdigest(), res, expire=CACHE_MAX_AGE)
 
     return hash_object, res
 
 
+def get_request_hash(kwargs):
+    key = json.dumps(kwargs, sort_keys=True).encode()
+    return hashlib.sha1(key)
+
+
+def cache_stream(key, completion):
+    # Pass the chunks through as they arrive, and only cache the stream once
+    # it has all been read. One cut short by ^C or an error isn't cached.
+    chunks = []
+    for chunk in completion:
+        chunks.append(chunk)
+        yield chunk
+
+    CACHE.set(key, chunks, expire=CACHE_MAX_AGE)
+
+
 def simple_send_with_retries(client, model_name, messages):
     try:
         _hash, response = send_with_retries(
@@ -1,5 +1,8 @@
+import hashlib
 import os
 import tempfile
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 import git
@@ -55,6 +58,58 @@ class GitTemporaryDirectory(ChdirTemporaryDirectory):
         super().__exit__(exc_type, exc_val, exc_tb)
 
 
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            return default
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.data.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+
+# Token counts shared by the models, chat summarizer and repo map, keyed by
+# encoding and a hash of the text, so unchanged text is only encoded once.
+token_counts = LRUCache(65536)
+token_counts_lock = threading.Lock()
+
+
+def count_tokens(tokenizer, text):
+    key = (tokenizer.name, hashlib.sha1(text.encode("utf-8")).digest())
+
+    # the repo map counts tokens on a background thread
+    with token_counts_lock:
+        num_tokens = token_counts.get(key)
+
+    if num_tokens is None:
+        num_tokens = len(tokenizer.encode(text))
+        with token_counts_lock:
+            token_counts.put(key, num_tokens)
+
+    return num_tokens
+
+
 def make_repo(path=None):
     if not path:
         path = "."
@@ -0,0 +1,264 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .dump import dump  # noqa: F401
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """
+    Keeps track of which files under root have changed.
+
+    Each consumer remembers the sequence number from its last call to
+    get_changes(), and gets back the set of files changed since then. None
+    means the watcher lost track, and everything needs to be re-checked.
+    """
+
+    backend = None
+
+    def __init__(self, root):
+        self.root = str(Path(root).resolve())
+        self.lock = threading.RLock()
+        self.seq = 1
+        self.reset_seq = 1
+        self.changed = dict()
+
+    def is_ignored(self, name):
+        return name == ".git" or name.startswith(".aider")
+
+    def mark_changed(self, fname):
+        with self.lock:
+            self.seq += 1
+            self.changed[str(fname)] = self.seq
+
+    def mark_all_changed(self):
+        with self.lock:
+            self.seq += 1
+            self.reset_seq = self.seq
+            self.changed = dict()
+
+    def poll(self):
+        pass
+
+    def track(self, fnames):
+        pass
+
+    def get_changes(self, since):
+        self.poll()
+
+        with self.lock:
+            if since is None or since < self.reset_seq:
+                return None, self.seq
+
+            changed = set(fname for fname, seq in self.changed.items() if seq > since)
+            return changed, self.seq
+
+    def last_change(self, fnames):
+        self.poll()
+
+        with self.lock:
+            changed = self.changed
+            return max([self.reset_seq] + [changed[fname] for fname in fnames if fname in changed])
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(FileWatcher):
+    backend = "inotify"
+
+    def __init__(self, root):
+        super().__init__(root)
+
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.wds = dict()
+        try:
+            self.add_tree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, path):
+        for dirpath, dirnames, _fnames in os.walk(path):
+            dirnames[:] = [dname for dname in dirnames if not self.is_ignored(dname)]
+            self.add_watch(dirpath)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            # usually ENOSPC, from hitting fs.inotify.max_user_watches
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.wds[wd] = path
+
+    def poll(self):
+        # drain the queued events, so changes made just before this call are seen
+        with self.lock:
+            if self.fd is None:
+                return
+
+            while True:
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    return
+                self.handle_events(data)
+
+    def handle_events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.mark_all_changed()
+                continue
+
+            dirpath = self.wds.get(wd)
+            if dirpath is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self.wds[wd]
+                continue
+
+            if name and self.is_ignored(name):
+                continue
+
+            path = os.path.join(dirpath, name) if name else dirpath
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        pass
+
+                # a whole directory of files appeared or went away
+                self.mark_all_changed()
+                continue
+
+            self.mark_changed(path)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+class PollingWatcher(FileWatcher):
+    """
+    Fallback for when inotify isn't available: stat the tracked files on a
+    background thread, off the critical path. Changes are seen up to
+    `interval` seconds late.
+    """
+
+    backend = "polling"
+
+    def __init__(self, root, interval=1.0):
+        super().__init__(root)
+
+        self.interval = interval
+        self.fnames = set()
+        self.stats = dict()
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self.poll_worker, daemon=True)
+        self.thread.start()
+
+    def track(self, fnames):
+        with self.lock:
+            self.fnames = set(fnames)
+
+    def poll_worker(self):
+        while not self.stopped.wait(self.interval):
+            self.scan()
+
+    def scan(self):
+        with self.lock:
+            fnames = set(self.fnames)
+
+        stats = dict()
+        for fname in fnames:
+            try:
+                stat = os.stat(fname)
+                stats[fname] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stats[fname] = None
+
+        with self.lock:
+            for fname, stat in stats.items():
+                # newly tracked files count as changed, we don't know their history
+                if fname not in self.stats or self.stats[fname] != stat:
+                    self.mark_changed(fname)
+            self.stats = stats
+
+    def close(self):
+        self.stopped.set()
+
+
+def get_file_watcher(root):
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError):
+        return PollingWatcher(root)
+
+
+if __name__ == "__main__":
+    watcher = get_file_watcher(sys.argv[1] if len(sys.argv) > 1 else ".")
+    print(f"Watching {watcher.root} with {watcher.backend}")
+
+    seq = None
+    while True:
+        changed, seq = watcher.get_changes(seq)
+        if changed:
+            for fname in sorted(changed):
+                print(fname)
+        time.sleep(1)
@@ -25,10 +25,11 @@ import typer
 from imgcat import imgcat
 from rich.console import Console
 
-from aider import models
+from aider import models, sendchat
 from aider.coders import Coder
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
+from aider.replay import Recorder, ReplayClient
 
 BENCHMARK_DNAME = Path(os.environ.get("AIDER_BENCHMARK_DIR", "tmp.benchmarks"))
 
@@ -409,6 +410,26 @@ def main(
         "--replay",
         help="Replay previous .aider.chat.history.md responses from previous benchmark run",
     ),
+    record_stream: str = typer.Option(
+        None,
+        "--record-stream",
+        help="Stream responses, recording each one's chunks and their timing to this directory",
+    ),
+    replay_stream: str = typer.Option(
+        None,
+        "--replay-stream",
+        help="Replay the streamed responses recorded with --record-stream, without the api",
+    ),
+    replay_speed: float = typer.Option(
+        0,
+        "--replay-speed",
+        help="Replay streams this many times faster than recorded, 0 for as fast as possible",
+    ),
+    openai_api_base: str = typer.Option(
+        None,
+        "--openai-api-base",
+        help="Send requests to this api base url, like a local `python -m aider.mockserver`",
+    ),
     max_apply_update_errors: int = typer.Option(
         3,
         "--max-apply-update-errors",
@@ -500,6 +521,9 @@ def main(
     if num_tests > 0:
         test_dnames = test_dnames[:num_tests]
 
+    if record_stream:
+        sendchat.RECORDER = Recorder(record_stream)
+
     if threads == 1:
         all_results = []
         for testname in test_dnames:
@@ -515,6 +539,9 @@ def main(
                 commit_hash,
                 replay,
                 max_apply_update_errors,
+                replay_stream,
+                replay_speed,
+                openai_api_base,
             )
 
             all_results.append(results)
@@ -534,6 +561,9 @@ def main(
                 commit_hash,
                 replay,
                 max_apply_update_errors,
+                replay_stream,
+                replay_speed,
+                openai_api_base,
             )
         all_results = run_test_threaded.gather(tqdm=True)
 
@@ -734,6 +764,9 @@ def run_test(
     commit_hash,
     replay,
     max_apply_update_errors,
+    replay_stream=None,
+    replay_speed=0,
+    openai_api_base=None,
 ):
     if not os.path.isdir(testdir):
         print("Not a dir:", testdir)
@@ -795,7 +828,10 @@ def run_test(
     show_fnames = ",".join(map(str, fnames))
     print("fnames:", show_fnames)
 
-    client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    if replay_stream:
+        client = ReplayClient(replay_stream, speed=replay_speed)
+    else:
+        client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"], base_url=openai_api_base)
 
     coder = Coder.create(
         main_model,
@@ -804,7 +840,7 @@ def run_test(
         client=client,
         fnames=fnames,
         use_git=False,
-        stream=False,
+        stream=bool(sendchat.RECORDER or replay_stream),
         pretty=False,
         verbose=verbose,
     )
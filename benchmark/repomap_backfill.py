@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Compare backfilling repo map refs from tree-sitter identifier nodes against
+tokenizing with pygments, for each language with a tags query.
+
+    python benchmark/repomap_backfill.py /usr/include aider/
+
+Both are timed on every file found, not just the ones which need a backfill.
+Covered is the share of the names pygments found which tree-sitter found too.
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from grep_ast import filename_to_lang
+
+from aider.dump import dump  # noqa: F401
+from aider.repomap import (
+    find_src_files,
+    get_identifier_refs,
+    get_identifiers_query,
+    get_pygments_refs,
+    get_tags_query,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=["."])
+    parser.add_argument("--max-files", type=int, default=2000, help="Files per language")
+    args = parser.parse_args()
+
+    stats = defaultdict(lambda: defaultdict(float))
+
+    for path in args.paths:
+        for fname in find_src_files(path):
+            lang = filename_to_lang(fname)
+            if not lang or not get_tags_query(lang) or not get_identifiers_query(lang):
+                continue
+
+            lang_stats = stats[lang]
+            if lang_stats["files"] >= args.max_files:
+                continue
+
+            try:
+                code = Path(fname).read_text()
+            except (OSError, UnicodeError):
+                continue
+
+            ts_parser, _query = get_tags_query(lang)
+            tree = ts_parser.parse(bytes(code, "utf-8"))
+
+            start = time.perf_counter()
+            ts_refs = get_identifier_refs(get_identifiers_query(lang), tree)
+            lang_stats["tree-sitter"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            pygments_refs = get_pygments_refs(fname, code)
+            lang_stats["pygments"] += time.perf_counter() - start
+
+            ts_names = set(name for name, _line in ts_refs)
+            pygments_names = set(name for name, _line in pygments_refs)
+            if pygments_names:
+                lang_stats["covered"] += len(ts_names & pygments_names) / len(pygments_names)
+
+            lang_stats["files"] += 1
+            lang_stats["bytes"] += len(code)
+
+    print(
+        f"{'lang':12} {'files':>6} {'KB':>8} {'pygments':>10} {'tree-sitter':>12}"
+        f" {'speedup':>8} {'covered':>8}"
+    )
+    for lang, lang_stats in sorted(stats.items()):
+        files = int(lang_stats["files"])
+        if not files:
+            continue
+        pygments_time = lang_stats["pygments"]
+        ts_time = lang_stats["tree-sitter"]
+        speedup = pygments_time / ts_time if ts_time else 0
+        print(
+            f"{lang:12} {files:6} {lang_stats['bytes'] / 1024:8.0f}"
+            f" {pygments_time:9.2f}s {ts_time:11.2f}s {speedup:7.1f}x"
+            f" {lang_stats['covered'] / files:8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
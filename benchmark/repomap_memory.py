@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Compare the memory used to hold a repo's tags as lists of Tag tuples, the way
+the tags cache used to store them, against TagTable columns.
+
+    python benchmark/repomap_memory.py aider/ --copies 50
+
+Each copy re-uses the parsed files under a new path, to simulate a large repo
+without having to parse one.
+"""
+
+import argparse
+import gc
+import os
+import pickle
+import tracemalloc
+from pathlib import Path
+
+from tqdm import tqdm
+
+from aider.dump import dump  # noqa: F401
+from aider.repomap import TagTable, find_src_files, get_tags_raw
+
+
+def parse_tags(paths):
+    tags = dict()
+    for path in paths:
+        for fname in find_src_files(path):
+            fname = os.path.abspath(fname)
+            try:
+                code = Path(fname).read_text()
+            except (OSError, UnicodeError):
+                continue
+            rel_fname = os.path.relpath(fname)
+            file_tags = list(get_tags_raw(fname, rel_fname, code) or [])
+            if file_tags:
+                tags[rel_fname] = file_tags
+    return tags
+
+
+def copy_tags(tags, copy):
+    if not copy:
+        return tags
+
+    res = dict()
+    for rel_fname, file_tags in tags.items():
+        rel_fname = os.path.join(f"copy{copy}", rel_fname)
+        fname = os.path.abspath(rel_fname)
+        res[rel_fname] = [tag._replace(rel_fname=rel_fname, fname=fname) for tag in file_tags]
+    return res
+
+
+def load_cached(cached):
+    # one unpickled value per file, as read back from the tags cache
+    return [pickle.loads(data) for data in cached]
+
+
+def measure(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    res = func(*args)
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=["aider"])
+    parser.add_argument("--copies", type=int, default=10, help="Copies of the files to hold")
+    args = parser.parse_args()
+
+    tags = parse_tags(args.paths)
+
+    tag_lists = []
+    tag_tables = []
+    for copy in tqdm(range(args.copies)):
+        for file_tags in copy_tags(tags, copy).values():
+            tag_lists.append(pickle.dumps(file_tags))
+            tag_tables.append(pickle.dumps(TagTable.from_tags(file_tags)))
+
+    num_files = len(tag_lists)
+    num_tags = sum(len(file_tags) for file_tags in tags.values()) * args.copies
+
+    lists, lists_mem = measure(load_cached, tag_lists)
+    del lists
+    tables, tables_mem = measure(load_cached, tag_tables)
+    del tables
+
+    lists_disk = sum(len(data) for data in tag_lists)
+    tables_disk = sum(len(data) for data in tag_tables)
+
+    print(f"{num_files} files, {num_tags} tags")
+    print()
+    print(f"{'':12} {'memory':>12} {'cache':>12} {'bytes/tag':>10}")
+    for label, mem, disk in [
+        ("Tag lists", lists_mem, lists_disk),
+        ("TagTables", tables_mem, tables_disk),
+    ]:
+        mem_mb = mem / 1024 / 1024
+        disk_mb = disk / 1024 / 1024
+        print(f"{label:12} {mem_mb:10.1f}MB {disk_mb:10.1f}MB {mem / num_tags:10.1f}")
+    print()
+    print(
+        f"memory: {lists_mem / tables_mem:.1f}x smaller, cache: {lists_disk / tables_disk:.1f}x"
+        " smaller"
+    )
+
+
+if __name__ == "__main__":
+    main()
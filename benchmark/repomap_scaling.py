@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""
+Measure how RepoMap scales on synthetic repos, and compare runs between commits.
+
+    python benchmark/repomap_scaling.py --sizes 1000,10000 --output before.json
+    python benchmark/repomap_scaling.py --sizes 1000,10000 --output after.json
+    python benchmark/repomap_scaling.py --compare before.json after.json
+
+Each repo has files in every language with a tags query, each defining a few
+functions which call functions in other files. The calls favor some files
+over others, so the graph has hubs like a real repo's. Every size runs in its
+own process, so peak RSS is measured per size.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aider.dump import dump  # noqa: F401
+from aider.io import InputOutput
+from aider.repomap import RepoMap, get_tags_query
+
+# (extension, file template, def template), filled in with f"f{file}_{num}" names
+LANGUAGES = dict(
+    python=(".py", "{defs}", "def {name}(x):\n    return {call}(x) + {call2}(x)\n\n"),
+    javascript=(".js", "{defs}", "function {name}(x) {{\n  return {call}(x) + {call2}(x);\n}}\n"),
+    # the typescript query only finds defs in signatures
+    typescript=(
+        ".ts",
+        "{defs}",
+        "declare function {name}(x: number): number;\nconst v{name} = {call}(1) + {call2}(1);\n",
+    ),
+    go=(
+        ".go",
+        "package main\n\n{defs}",
+        "func {name}(x int) int {{\n\treturn {call}(x) + {call2}(x)\n}}\n",
+    ),
+    rust=(".rs", "{defs}", "pub fn {name}(x: i32) -> i32 {{\n    {call}(x) + {call2}(x)\n}}\n"),
+    java=(
+        ".java",
+        "class C{file} {{\n{defs}}}\n",
+        "  static int {name}(int x) {{\n    return {call}(x) + {call2}(x);\n  }}\n",
+    ),
+    c=(".c", "{defs}", "int {name}(int x) {{\n    return {call}(x) + {call2}(x);\n}}\n"),
+    cpp=(
+        ".cpp",
+        "namespace n{file} {{\n{defs}}}\n",
+        "int {name}(int x) {{\n    return {call}(x) + {call2}(x);\n}}\n",
+    ),
+    c_sharp=(
+        ".cs",
+        "class C{file} {{\n{defs}}}\n",
+        "  static int {name}(int x) {{\n    return {call}(x) + {call2}(x);\n  }}\n",
+    ),
+    ruby=(".rb", "{defs}", "def {name}(x)\n  {call}(x) + {call2}(x)\nend\n"),
+    php=(
+        ".php",
+        "<?php\n{defs}",
+        "function {name}($x) {{\n    return {call}($x) + {call2}($x);\n}}\n",
+    ),
+    elixir=(
+        ".ex",
+        "defmodule M{file} do\n{defs}end\n",
+        "  def {name}(x), do: {call}(x) + {call2}(x)\n",
+    ),
+    elm=(
+        ".elm",
+        "module M{file} exposing (..)\n\n{defs}",
+        "{name} x =\n    {call} x + {call2} x\n\n",
+    ),
+    ocaml=(".ml", "{defs}", "let {name} x = {call} x + {call2} x\n"),
+    elisp=(".el", "{defs}", "(defun {name} (x)\n  (+ ({call} x) ({call2} x)))\n"),
+    ql=(".ql", "{defs}", "predicate {name}(int x) {{ {call}(x) or {call2}(x) }}\n"),
+)
+
+
+def get_languages():
+    langs = []
+    for lang in sorted(LANGUAGES):
+        try:
+            if get_tags_query(lang):
+                langs.append(lang)
+        except Exception as err:
+            # some grammar versions reject the tags query
+            print(f"Skipping {lang}: {err}", file=sys.stderr)
+    return langs
+
+
+def generate_repo(root, num_files, defs_per_file=8, seed=0):
+    rand = random.Random(seed)
+    langs = get_languages()
+
+    def pick_name():
+        # skewed towards low numbered files, which become the hubs
+        file_num = int(num_files * rand.random() ** 3)
+        return f"f{file_num}_{rand.randrange(defs_per_file)}"
+
+    fnames = []
+    for file_num in range(num_files):
+        lang = langs[file_num % len(langs)]
+        ext, file_template, def_template = LANGUAGES[lang]
+
+        defs = ""
+        for def_num in range(defs_per_file):
+            defs += def_template.format(
+                name=f"f{file_num}_{def_num}", call=pick_name(), call2=pick_name()
+            )
+
+        subdir = Path(root) / f"pkg{file_num // 500}"
+        subdir.mkdir(parents=True, exist_ok=True)
+        fname = subdir / f"mod{file_num}{ext}"
+        fname.write_text(file_template.format(file=file_num, defs=defs))
+        fnames.append(str(fname))
+
+    return fnames
+
+
+def get_dir_size(path):
+    size = 0
+    for dirpath, _dirnames, fnames in os.walk(path):
+        for fname in fnames:
+            size += os.path.getsize(os.path.join(dirpath, fname))
+    return size
+
+
+def get_peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, KB elsewhere
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def load_tags(repo_map, fnames):
+    with repo_map.batch_tags_cache(fnames):
+        for fname in fnames:
+            repo_map.get_tag_table(fname, repo_map.get_rel_fname(fname))
+
+
+def run_size(num_files, args):
+    root = tempfile.mkdtemp(prefix="repomap-bench-")
+    io = InputOutput(pretty=False, yes=True)
+
+    def make_repo_map():
+        return RepoMap(
+            map_tokens=args.map_tokens,
+            root=root,
+            io=io,
+            map_processes=args.processes,
+            ranking=args.ranking,
+        )
+
+    try:
+        fnames, generate_time = timed(generate_repo, root, num_files)
+        chat_fnames = fnames[:2]
+        other_fnames = fnames[2:]
+
+        result = dict(files=num_files, generate_sec=generate_time)
+
+        # cold: nothing cached, every file is parsed
+        repo_map = make_repo_map()
+        _, result["cold_tags_sec"] = timed(repo_map.prefetch_tags, fnames)
+        _, load_time = timed(load_tags, repo_map, fnames)
+        result["cold_tags_sec"] += load_time
+        del repo_map
+
+        # warm: a new session, with every file's tags cached on disk
+        repo_map = make_repo_map()
+        _, result["warm_tags_sec"] = timed(load_tags, repo_map, fnames)
+
+        # ranking, building the graph from the cached tags
+        ranked_tags, result["rank_first_sec"] = timed(
+            repo_map.get_ranked_tags, chat_fnames, other_fnames
+        )
+        result["ranked_tags"] = len(ranked_tags)
+
+        # ranking again, with the graph already built and nothing changed
+        _, result["rank_again_sec"] = timed(repo_map.get_ranked_tags, chat_fnames, other_fnames)
+
+        # the bisection for the largest map which fits in the token budget
+        repo_map.map_blocks.clear()
+        repo_map.render_cache.clear()
+        repo_map.tree_contexts.clear()
+        map_text, result["map_sec"] = timed(repo_map.get_ranked_tags_map, chat_fnames, other_fnames)
+        result["map_tokens"] = repo_map.token_count(map_text or "")
+
+        result["peak_rss_mb"] = get_peak_rss()
+        result["tags_cache_mb"] = get_dir_size(Path(root) / RepoMap.TAGS_CACHE_DIR) / 1024 / 1024
+
+        del repo_map
+        return result
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    for num_files in args.sizes:
+        print(f"Benchmarking {num_files} files...", file=sys.stderr)
+
+        # a fresh process for each size, so peak RSS is its own
+        cmd = [sys.executable, __file__, "--one", str(num_files)]
+        cmd += ["--processes", str(args.processes), "--ranking", args.ranking]
+        cmd += ["--map-tokens", str(args.map_tokens)]
+        out = subprocess.check_output(cmd, text=True)
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    report = dict(
+        commit=get_commit(),
+        date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        processes=args.processes,
+        ranking=args.ranking,
+        map_tokens=args.map_tokens,
+        results=results,
+    )
+
+    show_results(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=4) + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+COLUMNS = [
+    ("cold_tags_sec", "cold tags", "{:.2f}s"),
+    ("warm_tags_sec", "warm tags", "{:.2f}s"),
+    ("rank_first_sec", "rank", "{:.2f}s"),
+    ("rank_again_sec", "rerank", "{:.2f}s"),
+    ("map_sec", "map", "{:.2f}s"),
+    ("peak_rss_mb", "peak RSS", "{:.0f}MB"),
+    ("tags_cache_mb", "cache", "{:.1f}MB"),
+]
+
+
+def show_results(report):
+    print(f"commit {report['commit']}, {report['processes']} processes, {report['ranking']}")
+    print(f"{'files':>8}" + "".join(f" {label:>10}" for _key, label, _fmt in COLUMNS))
+    for result in report["results"]:
+        row = f"{result['files']:8}"
+        for key, _label, fmt in COLUMNS:
+            row += f" {fmt.format(result[key]):>10}"
+        print(row)
+
+
+def compare(before_fname, after_fname):
+    before = json.loads(Path(before_fname).read_text())
+    after = json.loads(Path(after_fname).read_text())
+
+    print(f"{before['commit']} -> {after['commit']}, after / before")
+    print(f"{'files':>8}" + "".join(f" {label:>10}" for _key, label, _fmt in COLUMNS))
+
+    before_results = dict((result["files"], result) for result in before["results"])
+    for result in after["results"]:
+        old = before_results.get(result["files"])
+        if not old:
+            continue
+        row = f"{result['files']:8}"
+        for key, _label, _fmt in COLUMNS:
+            if old.get(key):
+                row += f" {result[key] / old[key]:>9.2f}x"
+            else:
+                row += f" {'-':>10}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda sizes: [int(size) for size in sizes.split(",")],
+        default=[1000, 10000],
+        help="Comma separated repo sizes, in files (default: 1000,10000)",
+    )
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--ranking", choices=RepoMap.ranking_backends, default="networkx")
+    parser.add_argument("--map-tokens", type=int, default=1024)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.one:
+        print(json.dumps(run_size(args.one, args)))
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
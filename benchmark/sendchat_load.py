@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Load test send_with_retries and streaming against the local mock api server.
+
+    python benchmark/sendchat_load.py --threads 8 --requests 50 --ttft 0.3 \\
+        --tokens-per-sec 100 --fault 429=0.05 --fault drop=0.02
+
+Each thread streams its requests through one shared openai client, the way
+the coder does, and reports the time to first token, total latency and how
+many requests send_with_retries had to retry.
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from aider.dump import dump  # noqa: F401
+from aider.httpclient import ConnectionStats, make_http_client
+from aider.mockserver import MockServer, parse_fault_rate
+from aider.sendchat import send_with_retries
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def stream_one(client, model, num):
+    messages = [dict(role="user", content=f"Request {num}: " + "lorem ipsum " * 20)]
+
+    start = time.perf_counter()
+    first = None
+    _hash, completion = send_with_retries(client, model, messages, None, True)
+    for chunk in completion:
+        if first is None and chunk.choices and chunk.choices[0].delta.content:
+            first = time.perf_counter()
+    end = time.perf_counter()
+
+    return (first or end) - start, end - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per thread")
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument(
+        "--fault",
+        type=parse_fault_rate,
+        action="append",
+        default=[],
+        metavar="FAULT=RATE",
+        help="Inject a fault (429, 500, drop or drop_stream) into this share of requests",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockServer(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        fault_rates=dict(args.fault),
+        seed=args.seed,
+    )
+
+    ttfts = []
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(num):
+        try:
+            ttft, latency = stream_one(client, args.model, num)
+        except Exception as err:
+            with lock:
+                failures.append(err)
+            return
+        with lock:
+            ttfts.append(ttft)
+            latencies.append(latency)
+
+    # send_with_retries prints each retry
+    retries = io.StringIO()
+
+    with server:
+        # leave the retrying to send_with_retries
+        stats = ConnectionStats()
+        client = openai.OpenAI(
+            base_url=server.url,
+            api_key="mock",
+            max_retries=0,
+            http_client=make_http_client(stats),
+        )
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(retries):
+            with ThreadPoolExecutor(args.threads) as executor:
+                list(executor.map(worker, range(args.threads * args.requests)))
+        elapsed = time.perf_counter() - start
+
+    num_retries = retries.getvalue().count("Retry in")
+
+    print(
+        f"{len(latencies)} requests in {elapsed:.2f}s, {len(latencies) / elapsed:.1f}/s, with"
+        f" {args.threads} threads"
+    )
+    print(f"{len(server.requests)} sent, {num_retries} retried, {len(failures)} failed")
+    print(stats.summary())
+    print()
+    print(f"{'':14} {'p50':>8} {'p95':>8} {'p99':>8} {'mean':>8}")
+    for label, values in [("first token", ttfts), ("latency", latencies)]:
+        mean = statistics.mean(values) if values else 0
+        print(
+            f"{label:14} {percentile(values, 50):7.3f}s {percentile(values, 95):7.3f}s"
+            f" {percentile(values, 99):7.3f}s {mean:7.3f}s"
+        )
+
+    if failures:
+        print()
+        errors = sorted(set(f"{type(err).__name__}: {err}" for err in failures))
+        for error in errors:
+            print(error, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
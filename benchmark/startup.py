@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+Measure how long aider takes to start, and compare runs between commits.
+
+    python benchmark/startup.py --output before.json
+    python benchmark/startup.py --output after.json
+    python benchmark/startup.py --compare before.json after.json
+
+Every run is a fresh python process, timed from launch to exit:
+
+    import        import aider.main
+    help          aider --help
+    first prompt  create a Coder on a small git repo and build the messages
+                  for its first prompt, up to where they would be sent
+
+The first prompt's tags cache is warmed by the first run, as it would be by
+an earlier session in the same repo.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aider.dump import dump  # noqa: F401
+
+
+def first_prompt(root):
+    from aider import models
+    from aider.coders import Coder
+    from aider.io import InputOutput
+
+    os.chdir(root)
+    io = InputOutput(pretty=False, yes=True)
+    coder = Coder.create(
+        models.GPT4, None, io, fnames=["main.py"], skip_model_availabily_check=True
+    )
+    coder.cur_messages = [dict(role="user", content="Add a docstring to main")]
+    coder.format_messages()
+
+
+def make_repo(root, num_files=20):
+    for i in range(num_files):
+        code = f"def func{i}():\n    return func{(i + 1) % num_files}()\n"
+        Path(root, f"mod{i}.py").write_text(code)
+    Path(root, "main.py").write_text("from mod0 import func0\n\n\ndef main():\n    func0()\n")
+
+    subprocess.check_call(["git", "init", "-q"], cwd=root)
+    subprocess.check_call(["git", "add", "."], cwd=root)
+    subprocess.check_call(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+        + ["commit", "-q", "-m", "init"],
+        cwd=root,
+    )
+
+
+def time_process(cmd):
+    start = time.perf_counter()
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix="startup-bench-")
+    try:
+        make_repo(root)
+
+        cmds = dict(
+            import_sec=[sys.executable, "-c", "import aider.main"],
+            help_sec=[sys.executable, "-m", "aider.main", "--help"],
+            first_prompt_sec=[sys.executable, __file__, "--one", root],
+        )
+
+        results = dict()
+        for key, cmd in cmds.items():
+            print(f"Timing {key}...", file=sys.stderr)
+            times = []
+            for _ in range(args.runs):
+                times.append(time_process(cmd))
+            results[key] = statistics.median(times)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = dict(
+        commit=get_commit(),
+        date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        runs=args.runs,
+        results=results,
+    )
+
+    show_results(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=4) + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COLUMNS = [
+    ("import_sec", "import"),
+    ("help_sec", "help"),
+    ("first_prompt_sec", "first prompt"),
+]
+
+
+def show_results(report):
+    print(f"commit {report['commit']}, median of {report['runs']} runs")
+    print("".join(f" {label:>12}" for _key, label in COLUMNS))
+    print("".join(f" {report['results'][key]:11.2f}s" for key, _label in COLUMNS))
+
+
+def compare(before_fname, after_fname):
+    before = json.loads(Path(before_fname).read_text())
+    after = json.loads(Path(after_fname).read_text())
+
+    print(f"{before['commit']} -> {after['commit']}, after / before")
+    print("".join(f" {label:>12}" for _key, label in COLUMNS))
+    row = ""
+    for key, _label in COLUMNS:
+        old = before["results"].get(key)
+        if old:
+            row += f" {after['results'][key] / old:>11.2f}x"
+        else:
+            row += f" {'-':>12}"
+    print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs of each, the median is shown")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.one:
+        first_prompt(args.one)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
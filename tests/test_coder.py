@@ -1,4 +1,5 @@
 import tempfile
+import threading
 import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, patch
@@ -122,6 +123,99 @@ class TestCoder(unittest.TestCase):
             fname.unlink()
             self.assertEqual(coder.get_last_modified(), 0)
 
+    def test_repo_map_start_precomputes_map(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            for i in range(3):
+                fname = Path(f"file{i}.py")
+                fname.write_text(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                repo.git.add(str(fname))
+            repo.git.commit("-m", "init")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(models.GPT4, None, io, fnames=["file0.py"])
+            coder.repo_map.cache_missing = False
+
+            with patch.object(
+                coder.main_model, "token_count", wraps=coder.main_model.token_count
+            ) as mock_count:
+                coder.repo_map_start()
+                coder.repo_map_end()
+
+            # the chat file's tokens were counted in the background too
+            fname = str(Path("file0.py").resolve())
+            block = coder.get_file_block(fname, Path(fname).read_text())
+            mock_count.assert_any_call(block)
+
+            with patch.object(coder.repo_map, "build_repo_map") as mock_build:
+                repo_map = coder.get_repo_map()
+                mock_build.assert_not_called()
+
+            self.assertIn("func1", repo_map)
+            self.assertEqual(coder.repo_map.map_memo_hits, 1)
+
+    def test_repo_map_start_restarts_when_chat_files_change(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            for i in range(3):
+                fname = Path(f"file{i}.py")
+                fname.write_text(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                repo.git.add(str(fname))
+            repo.git.commit("-m", "init")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(models.GPT4, None, io, fnames=["file0.py"])
+            coder.repo_map.cache_missing = False
+
+            coder.repo_map_start()
+            thread, _chat_files, cancelled, _result = coder.repo_map_thread
+
+            # same chat files, keep the running thread
+            coder.repo_map_start()
+            self.assertIs(coder.repo_map_thread[0], thread)
+
+            coder.commands.cmd_add("file1.py")
+            self.assertTrue(cancelled.is_set())
+            self.assertIsNot(coder.repo_map_thread[0], thread)
+
+            repo_map = coder.get_repo_map()
+            self.assertNotIn("file1.py", repo_map)
+            self.assertIn("file2.py", repo_map)
+
+    def test_repo_map_worker_output_shown_by_repo_map_end(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            for i in range(3):
+                fname = Path(f"file{i}.py")
+                fname.write_text(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                repo.git.add(str(fname))
+
+            # not utf-8, so reading it is an error
+            Path("latin.py").write_bytes("def caf\xe9():\n    pass\n".encode("latin-1"))
+            repo.git.add("latin.py")
+            repo.git.commit("-m", "init")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(models.GPT4, None, io, fnames=["file0.py"])
+            coder.repo_map.cache_missing = False
+
+            with patch.object(io, "tool_error") as mock_error:
+                coder.repo_map_start()
+                coder.repo_map_thread[0].join()
+
+                # held back while the prompt is up
+                mock_error.assert_not_called()
+
+                with patch.object(coder, "get_all_abs_files") as mock_files:
+                    repo_map = coder.get_repo_map()
+                    mock_files.assert_not_called()
+
+                messages = [call[0][0] for call in mock_error.call_args_list]
+                self.assertTrue(any("latin.py" in message for message in messages))
+
+            self.assertIn("func1", repo_map)
+            self.assertIs(coder.repo_map.io, io)
+
     def test_get_files_content(self):
         tempdir = Path(tempfile.mkdtemp())
 
@@ -140,6 +234,31 @@ class TestCoder(unittest.TestCase):
         self.assertIn("file1.txt", content)
         self.assertIn("file2.txt", content)
 
+    def test_format_messages_only_counts_changed_files(self):
+        with ChdirTemporaryDirectory():
+            file1 = Path("file1.txt")
+            file2 = Path("file2.txt")
+            file1.write_text("one\n" * 100)
+            file2.write_text("two\n" * 100)
+
+            coder = Coder.create(
+                models.GPT4, None, io=InputOutput(), fnames=[file1, file2], use_git=False
+            )
+            coder.format_messages()
+
+            file2.write_text("three\n" * 100)
+
+            encoded = []
+            tokenizer = coder.main_model.tokenizer
+            with patch.object(coder.main_model, "tokenizer") as mock_tokenizer:
+                mock_tokenizer.name = tokenizer.name
+                mock_tokenizer.encode.side_effect = lambda text: encoded.append(text) or [0]
+                coder.format_messages()
+
+            self.assertEqual(len(encoded), 1)
+            self.assertIn("three", encoded[0])
+            self.assertNotIn("one", encoded[0])
+
     def test_check_for_filename_mentions(self):
         with GitTemporaryDirectory():
             repo = git.Repo()
@@ -578,6 +697,57 @@ two
             diff = saved_diffs[0]
             self.assertIn("file.txt", diff)
 
+    def test_background_commit_message_and_undo(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "initial")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(
+                models.GPT4, "diff", io=io, fnames=[str(fname)], background_commit_messages=True
+            )
+
+            def mock_send(*args, **kwargs):
+                coder.partial_response_content = f"""
+Do this:
+
+{str(fname)}
+<<<<<<< SEARCH
+one
+=======
+two
+>>>>>>> REPLACE
+
+"""
+                coder.partial_response_function_call = dict()
+
+            # hold the commit message back until the edit is committed
+            ready = threading.Event()
+
+            def mock_get_commit_message(diffs, context, errors=None):
+                ready.wait(5)
+                return "commit message"
+
+            coder.send = MagicMock(side_effect=mock_send)
+            coder.repo.get_commit_message = MagicMock(side_effect=mock_get_commit_message)
+
+            coder.run(with_message="hi")
+
+            provisional_hash = coder.last_aider_commit_hash
+            self.assertEqual(repo.head.commit.hexsha[:7], provisional_hash)
+            self.assertEqual(repo.head.commit.message.splitlines()[0], "aider: Edit file.txt")
+
+            ready.set()
+            coder.commands.cmd_undo("")
+
+            self.assertNotEqual(coder.last_aider_commit_hash, provisional_hash)
+            self.assertEqual(repo.head.commit.message.strip(), "initial")
+            self.assertEqual(fname.read_text(), "one\n")
+
 
 if __name__ == "__main__":
     unittest.main()
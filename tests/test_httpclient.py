@@ -0,0 +1,75 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+import openai
+
+from aider.dump import dump  # noqa: F401
+from aider.httpclient import ConnectionStats, make_http_client
+from aider.mockserver import MockServer
+from aider.sendchat import send_with_retries
+
+MESSAGES = [dict(role="user", content="hello")]
+
+
+class TestHttpClient(unittest.TestCase):
+    def test_calls_share_a_pooled_connection(self):
+        stats = ConnectionStats()
+        http_client = make_http_client(stats, http2=False)
+
+        with MockServer() as server:
+            client = openai.OpenAI(
+                base_url=server.url, api_key="mock", max_retries=0, http_client=http_client
+            )
+
+            client.models.list()
+            send_with_retries(client, "gpt-4", MESSAGES, None, False)
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, True)
+            list(completion)
+            send_with_retries(client, "gpt-4", MESSAGES, None, False)
+
+            http_client.close()
+
+        self.assertEqual(stats.num_calls, 4)
+        self.assertEqual(stats.num_connections, 1)
+        self.assertEqual([call.new_connection for call in stats.calls], [True, False, False, False])
+        self.assertEqual(stats.calls[0].path, "/v1/models")
+        self.assertEqual(stats.calls[1].path, "/v1/chat/completions")
+        self.assertGreaterEqual(stats.calls[0].connect_time, 0)
+        self.assertEqual(stats.summary(), "4 api calls over 1 connections, 3 reused")
+
+    def test_stats_output(self):
+        output = MagicMock()
+        stats = ConnectionStats(output)
+        http_client = make_http_client(stats, http2=False)
+
+        with MockServer() as server:
+            http_client.get(server.url + "/models")
+            http_client.get(server.url + "/models")
+            http_client.close()
+
+        messages = [call[0][0] for call in output.call_args_list]
+        self.assertTrue(messages[0].startswith("/v1/models: new connection in "))
+        self.assertEqual(messages[1], "/v1/models: reused connection")
+
+    def test_stats_output_from_background_threads(self):
+        output = MagicMock()
+        stats = ConnectionStats(output)
+        http_client = make_http_client(stats, http2=False)
+
+        with MockServer() as server:
+            thread = threading.Thread(target=http_client.get, args=(server.url + "/models",))
+            thread.start()
+            thread.join()
+            output.assert_not_called()
+
+            http_client.get(server.url + "/models")
+            http_client.close()
+
+        messages = [call[0][0] for call in output.call_args_list]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith("/v1/models: new connection in "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from aider.dump import dump  # noqa: F401
+from aider.importtime import Import, get_slowest_imports, parse_importtime
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _abc
+import time:       200 |        300 | site
+import time:        50 |         50 |       httpcore
+import time:       400 |        450 |     httpx
+import time:      1000 |       1450 |   openai
+import time:        20 |         20 |   aider.dump
+import time:        30 |       1500 | aider.main
+Traceback (most recent call last):
+"""
+
+
+class TestImportTime(unittest.TestCase):
+    def test_parse_importtime(self):
+        imports = parse_importtime(IMPORTTIME)
+
+        self.assertEqual(
+            imports,
+            [
+                Import("_abc", "site", 100, 100),
+                Import("site", None, 200, 300),
+                Import("httpcore", "httpx", 50, 50),
+                Import("httpx", "openai", 400, 450),
+                Import("openai", "aider.main", 1000, 1450),
+                Import("aider.dump", "aider.main", 20, 20),
+                Import("aider.main", None, 30, 1500),
+            ],
+        )
+
+    def test_get_slowest_imports(self):
+        imports = parse_importtime(IMPORTTIME)
+
+        names = [imp.name for imp in get_slowest_imports(imports)]
+        self.assertEqual(names, ["openai", "site"])
+
+        names = [imp.name for imp in get_slowest_imports(imports, limit=1)]
+        self.assertEqual(names, ["openai"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
 from pathlib import Path
 from unittest import TestCase
@@ -51,6 +52,23 @@ class TestMain(TestCase):
         self.assertTrue(os.path.exists("foo.txt"))
         self.assertTrue(os.path.exists("bar.txt"))
 
+    @patch("aider.repo.GitRepo.get_commit_message", return_value="mock commit message")
+    def test_background_commit_message_applied_on_exit(self, _):
+        make_repo()
+        Path("foo.txt").write_text("one\n")
+
+        def run_and_exit(coder, with_message=None):
+            Path("foo.txt").write_text("two\n")
+            coder.auto_commit({"foo.txt"})
+            coder.commands.run("/exit")
+
+        with patch("aider.coders.Coder.run", autospec=True, side_effect=run_and_exit):
+            with self.assertRaises(SystemExit):
+                main(["--yes", "foo.txt"], input=DummyInput(), output=DummyOutput())
+
+        message = git.Repo().head.commit.message
+        self.assertTrue(message.startswith("aider: mock commit message\n"))
+
     def test_main_with_dname_and_fname(self):
         subdir = Path("subdir")
         subdir.mkdir()
@@ -75,13 +93,13 @@ class TestMain(TestCase):
         make_repo()
 
         Path(".aider.conf.yml").write_text("auto-commits: false\n")
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--yes"], input=DummyInput(), output=DummyOutput())
             _, kwargs = MockCoder.call_args
             assert kwargs["auto_commits"] is False
 
         Path(".aider.conf.yml").write_text("auto-commits: true\n")
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main([], input=DummyInput(), output=DummyOutput())
             _, kwargs = MockCoder.call_args
             assert kwargs["auto_commits"] is True
@@ -136,48 +154,48 @@ class TestMain(TestCase):
         self.assertFalse((cwd / ".git").exists())
         self.assertFalse((cwd / ".gitignore").exists())
 
-        with patch("aider.main.Coder.create"):
+        with patch("aider.coders.Coder.create"):
             main(["--yes"], input=DummyInput())
 
         self.assertTrue((cwd / ".git").exists())
         self.assertTrue((cwd / ".gitignore").exists())
 
     def test_main_args(self):
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             # --yes will just ok the git repo without blocking on input
             # following calls to main will see the new repo already
             main(["--no-auto-commits", "--yes"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["auto_commits"] is False
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--auto-commits"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["auto_commits"] is True
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main([], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["dirty_commits"] is True
             assert kwargs["auto_commits"] is True
             assert kwargs["pretty"] is True
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--no-pretty"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["pretty"] is False
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--pretty"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["pretty"] is True
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--no-dirty-commits"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["dirty_commits"] is False
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             main(["--dirty-commits"], input=DummyInput())
             _, kwargs = MockCoder.call_args
             assert kwargs["dirty_commits"] is True
@@ -188,7 +206,7 @@ class TestMain(TestCase):
         with open(message_file_path, "w", encoding="utf-8") as message_file:
             message_file.write(message_file_content)
 
-        with patch("aider.main.Coder.create") as MockCoder:
+        with patch("aider.coders.Coder.create") as MockCoder:
             MockCoder.return_value.run = MagicMock()
             main(
                 ["--yes", "--message-file", message_file_path],
@@ -203,7 +221,7 @@ class TestMain(TestCase):
         fname = "foo.py"
 
         with GitTemporaryDirectory():
-            with patch("aider.main.Coder.create") as MockCoder:  # noqa: F841
+            with patch("aider.coders.Coder.create") as MockCoder:  # noqa: F841
                 with patch("aider.main.InputOutput") as MockSend:
 
                     def side_effect(*args, **kwargs):
@@ -223,3 +241,38 @@ class TestMain(TestCase):
         main(["--message", test_message], input=DummyInput(), output=DummyOutput())
 
         mock_io_instance.add_to_input_history.assert_called_once_with(test_message)
+
+    def test_import_defers_heavy_modules(self):
+        code = "import sys, aider.main; print(' '.join(sorted(sys.modules)))"
+        res = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent.parent,
+        )
+        modules = res.stdout.split()
+
+        self.assertIn("aider.main", modules)
+        for name in ("openai", "aider.coders", "aider.repomap", "numpy", "scipy", "requests"):
+            self.assertNotIn(name, modules)
+
+    def test_profile_startup(self):
+        with GitTemporaryDirectory():
+            with patch("aider.importtime.subprocess.run") as mock_run:
+                mock_run.return_value.stderr = (
+                    "import time: self [us] | cumulative | imported package\n"
+                    "import time:        10 |         10 |   httpx\n"
+                    "import time:      1000 |       1010 | openai\n"
+                )
+                mock_run.return_value.returncode = 0
+
+                with patch("aider.coders.Coder.create") as MockCoder:
+                    main(
+                        ["--profile-startup", "--no-git"], input=DummyInput(), output=DummyOutput()
+                    )
+                    MockCoder.assert_not_called()
+
+            cmd = mock_run.call_args[0][0]
+            self.assertEqual(cmd[:3], [sys.executable, "-X", "importtime"])
+            self.assertIn("--profile-startup", cmd)
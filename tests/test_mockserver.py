@@ -0,0 +1,84 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import httpx
+import openai
+
+from aider.dump import dump  # noqa: F401
+from aider.mockserver import MockServer
+from aider.sendchat import send_with_retries
+
+MESSAGES = [dict(role="user", content="hello mock")]
+
+
+class TestMockServer(unittest.TestCase):
+    def make_client(self, server):
+        return openai.OpenAI(base_url=server.url, api_key="mock", max_retries=0)
+
+    def test_models_and_completion(self):
+        with MockServer(models=["gpt-4"]) as server:
+            client = self.make_client(server)
+            self.assertEqual([model.id for model in client.models.list()], ["gpt-4"])
+
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, False)
+
+        # echoes the last message by default
+        self.assertEqual(completion.choices[0].message.content, "hello mock")
+        self.assertEqual(server.requests[0]["messages"], MESSAGES)
+
+    def test_streamed_completion(self):
+        with MockServer(responses="one two three") as server:
+            client = self.make_client(server)
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, True)
+            chunks = [chunk.choices[0].delta.content for chunk in completion]
+
+        self.assertEqual(chunks, ["", "one", " two", " three", None])
+
+    def test_scripted_responses(self):
+        with MockServer(responses=["first", "second"]) as server:
+            client = self.make_client(server)
+            replies = []
+            for _ in range(3):
+                _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, False)
+                replies.append(completion.choices[0].message.content)
+
+        self.assertEqual(replies, ["first", "second", "first"])
+
+    @patch("builtins.print")
+    @patch("time.sleep")
+    def test_send_with_retries_backs_off_faults(self, mock_sleep, mock_print):
+        with MockServer(responses="ok", faults=[429, "drop", 500]) as server:
+            client = self.make_client(server)
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, False)
+
+        self.assertEqual(completion.choices[0].message.content, "ok")
+        self.assertEqual(server.faults_served, [429, "drop", 500])
+        self.assertEqual(len(server.requests), 4)
+        self.assertEqual(mock_print.call_count, 3)
+
+    def test_dropped_stream(self):
+        with MockServer(responses="one two three four", faults=["drop_stream"]) as server:
+            client = self.make_client(server)
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, True)
+            with self.assertRaises(httpx.RemoteProtocolError):
+                list(completion)
+
+    def test_time_to_first_token(self):
+        with MockServer(responses="one two", ttft=0.2, tokens_per_sec=20) as server:
+            client = self.make_client(server)
+
+            start = time.perf_counter()
+            _hash, completion = send_with_retries(client, "gpt-4", MESSAGES, None, True)
+            times = [time.perf_counter() - start for chunk in completion]
+
+        self.assertGreaterEqual(times[0], 0.2)
+        self.assertGreaterEqual(times[-1], 0.3)
+
+    def test_unknown_fault(self):
+        with self.assertRaises(ValueError):
+            MockServer(faults=[404])
+
+
+if __name__ == "__main__":
+    unittest.main()
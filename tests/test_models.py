@@ -1,7 +1,9 @@
+import json
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from aider.models import Model, OpenRouterModel
+from aider.models.model import get_encoding
 
 
 class TestModels(unittest.TestCase):
@@ -49,6 +51,46 @@ class TestModels(unittest.TestCase):
         self.assertEqual(model.prompt_price, 0.06)
         self.assertEqual(model.completion_price, 0.12)
 
+    def test_token_count_is_cached_per_message(self):
+        model = Model.create("gpt-4")
+        messages = [
+            dict(role="user", content="count the tokens in this message, once"),
+            dict(role="assistant", content="and in this one"),
+        ]
+        expected = sum(len(model.tokenizer.encode(json.dumps(msg))) for msg in messages)
+
+        self.assertEqual(model.token_count(messages), expected)
+
+        with patch.object(model.tokenizer, "encode", wraps=model.tokenizer.encode) as encode:
+            self.assertEqual(model.token_count(messages), expected)
+            encode.assert_not_called()
+
+            # only the new message is encoded
+            messages.append(dict(role="user", content="a new message"))
+            model.token_count(messages)
+            encode.assert_called_once_with(json.dumps(messages[-1]))
+
+    def test_tokenizer_is_loaded_lazily_and_shared(self):
+        with patch("aider.models.model.get_encoding", wraps=get_encoding) as mock_get:
+            gpt4 = Model.create("gpt-4")
+            gpt35 = Model.create("gpt-3.5-turbo-16k")
+            mock_get.assert_not_called()
+
+            self.assertIs(gpt4.tokenizer, gpt35.tokenizer)
+            self.assertEqual(gpt4.tokenizer.name, "cl100k_base")
+
+    def test_models_are_created_on_first_access(self):
+        import aider.models
+
+        aider.models.__dict__.pop("GPT35_16k", None)
+        with patch.object(Model, "create", wraps=Model.create) as mock_create:
+            model = aider.models.GPT35_16k
+            self.assertIs(aider.models.GPT35_16k, model)
+            mock_create.assert_called_once_with("gpt-3.5-turbo-16k")
+
+        with self.assertRaises(AttributeError):
+            aider.models.GPT5
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from diskcache import Cache
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from aider import models, sendchat
+from aider.coders import Coder
+from aider.dump import dump  # noqa: F401
+from aider.io import InputOutput
+from aider.replay import Recorder, ReplayClient, ReplayError
+from aider.sendchat import send_with_retries
+from aider.utils import ChdirTemporaryDirectory, IgnorantTemporaryDirectory
+
+
+def make_chunk(content):
+    return ChatCompletionChunk(
+        id="chunk",
+        choices=[dict(index=0, delta=dict(content=content), finish_reason=None)],
+        created=0,
+        model="gpt-4",
+        object="chat.completion.chunk",
+    )
+
+
+def make_completion(content):
+    return ChatCompletion(
+        id="completion",
+        choices=[
+            dict(
+                index=0,
+                message=dict(role="assistant", content=content),
+                finish_reason="stop",
+            )
+        ],
+        created=0,
+        model="gpt-4",
+        object="chat.completion",
+    )
+
+
+class TestReplay(unittest.TestCase):
+    def test_record_and_replay_stream(self):
+        chunks = [make_chunk("hello"), make_chunk(" world")]
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = iter(chunks)
+        messages = [dict(role="user", content="hi")]
+
+        with IgnorantTemporaryDirectory() as dname:
+            with patch.object(sendchat, "RECORDER", Recorder(dname)):
+                _hash, res = send_with_retries(mock_client, "gpt-4", messages, None, True)
+                self.assertEqual(list(res), chunks)
+
+            client = ReplayClient(dname, speed=0)
+            _hash, res = send_with_retries(client, "gpt-4", messages, None, True)
+            self.assertEqual(list(res), chunks)
+
+            self.assertEqual([model.id for model in client.models.list()], ["gpt-4"])
+
+            with self.assertRaises(ReplayError):
+                send_with_retries(client, "gpt-4", [dict(role="user", content="bye")], None, True)
+
+    def test_record_and_replay_completion(self):
+        completion = make_completion("hello")
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = completion
+        messages = [dict(role="user", content="hi")]
+
+        with IgnorantTemporaryDirectory() as dname:
+            with patch.object(sendchat, "RECORDER", Recorder(dname)):
+                send_with_retries(mock_client, "gpt-4", messages, None, False)
+
+            client = ReplayClient(dname, speed=0)
+            _hash, res = send_with_retries(client, "gpt-4", messages, None, False)
+            self.assertEqual(res, completion)
+
+    def test_record_cache_hits(self):
+        chunks = [make_chunk("hello"), make_chunk(" world")]
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = lambda **kwargs: iter(chunks)
+        messages = [dict(role="user", content="hi")]
+
+        with IgnorantTemporaryDirectory() as cache_dir, IgnorantTemporaryDirectory() as dname:
+            with patch.object(sendchat, "CACHE", Cache(cache_dir)):
+                _hash, res = send_with_retries(mock_client, "gpt-4", messages, None, True)
+                list(res)
+
+                with patch.object(sendchat, "RECORDER", Recorder(dname)):
+                    _hash, res = send_with_retries(mock_client, "gpt-4", messages, None, True)
+                    self.assertEqual(list(res), chunks)
+                mock_client.chat.completions.create.assert_called_once()
+
+                sendchat.CACHE.close()
+
+            client = ReplayClient(dname, speed=0)
+            _hash, res = send_with_retries(client, "gpt-4", messages, None, True)
+            self.assertEqual(list(res), chunks)
+
+    def test_replay_stream_keeps_timing(self):
+        client = ReplayClient(".", speed=2)
+        chunks = [(0.5, make_chunk("hello").model_dump()), (1.0, make_chunk("!").model_dump())]
+
+        with patch("aider.replay.time.sleep") as mock_sleep:
+            res = list(client.replay_stream(chunks))
+
+        self.assertEqual([chunk.choices[0].delta.content for chunk in res], ["hello", "!"])
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.25, 0.5])
+
+    def test_coder_streams_replayed_response(self):
+        chunks = [make_chunk("hello"), make_chunk(" world")]
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = iter(chunks)
+        messages = [dict(role="user", content="hi")]
+
+        with ChdirTemporaryDirectory() as dname:
+            with patch.object(sendchat, "RECORDER", Recorder(dname)):
+                _hash, res = send_with_retries(mock_client, "gpt-4", messages, None, True)
+                list(res)
+
+            coder = Coder.create(
+                models.GPT4,
+                None,
+                io=InputOutput(pretty=False),
+                client=ReplayClient(dname, speed=0),
+                use_git=False,
+                stream=True,
+                pretty=False,
+            )
+            coder.send(messages)
+
+            self.assertEqual(coder.partial_response_content, "hello world")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 import tempfile
+import threading
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -260,3 +261,121 @@ class TestRepo(unittest.TestCase):
             git_repo = GitRepo(InputOutput(), None, None)
 
             git_repo.commit(fnames=[str(fname)])
+
+    @patch("aider.repo.simple_send_with_retries")
+    def test_background_commit_message(self, mock_send):
+        mock_send.return_value = "a good commit message"
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            # staged, but not part of the commit, so must stay out of the amend
+            fname2 = Path("other.txt")
+            fname2.write_text("other\n")
+            raw_repo.git.add(str(fname2))
+
+            fname.write_text("two\n")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+            commit_hash, commit_message = git_repo.commit(
+                fnames=[str(fname)], context="USER: hi", prefix="aider: ", background=True
+            )
+            self.assertEqual(commit_message, "aider: Edit file.txt")
+            self.assertEqual(raw_repo.head.commit.hexsha[:7], commit_hash)
+
+            old_hash, new_hash = git_repo.apply_commit_message()
+            self.assertEqual(old_hash, commit_hash)
+            self.assertEqual(raw_repo.head.commit.hexsha[:7], new_hash)
+            self.assertNotEqual(new_hash, commit_hash)
+
+            message = raw_repo.head.commit.message
+            self.assertTrue(message.startswith("aider: a good commit message\n"))
+            self.assertIn("USER: hi", message)
+            self.assertEqual(list(raw_repo.head.commit.stats.files), ["file.txt"])
+            self.assertIn("other.txt", raw_repo.git.diff("--cached", "--name-only"))
+
+            self.assertIsNone(git_repo.apply_commit_message())
+
+    @patch("aider.repo.simple_send_with_retries")
+    def test_background_commit_message_head_moved(self, mock_send):
+        mock_send.return_value = "a good commit message"
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            fname.write_text("two\n")
+            git_repo = GitRepo(InputOutput(), None, None)
+            git_repo.commit(fnames=[str(fname)], prefix="aider: ", background=True)
+
+            raw_repo.git.commit("--allow-empty", "-m", "user commit")
+
+            self.assertIsNone(git_repo.apply_commit_message())
+            self.assertEqual(raw_repo.head.commit.message.strip(), "user commit")
+            self.assertEqual(
+                raw_repo.head.commit.parents[0].message.strip(), "aider: Edit file.txt"
+            )
+
+    @patch("aider.repo.simple_send_with_retries")
+    def test_background_commit_message_errors(self, mock_send):
+        mock_send.return_value = None
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            fname.write_text("two\n")
+            io = InputOutput()
+            git_repo = GitRepo(io, None, None)
+
+            with patch.object(io, "tool_error") as mock_error:
+                git_repo.commit(fnames=[str(fname)], prefix="aider: ", background=True)
+                git_repo.pending_message["thread"].join()
+
+                # not shown from the background thread
+                mock_error.assert_not_called()
+
+                self.assertIsNone(git_repo.apply_commit_message())
+                mock_error.assert_called_once_with("Failed to generate commit message!")
+
+            self.assertEqual(raw_repo.head.commit.message.strip(), "aider: Edit file.txt")
+
+    def test_background_commit_message_timeout(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            fname.write_text("two\n")
+            io = InputOutput()
+            git_repo = GitRepo(io, None, None)
+
+            ready = threading.Event()
+
+            def slow_commit_message(diffs, context, errors=None):
+                ready.wait(5)
+                return "a good commit message"
+
+            git_repo.get_commit_message = slow_commit_message
+            git_repo.commit(fnames=[str(fname)], prefix="aider: ", background=True)
+
+            with patch.object(io, "tool_error") as mock_error:
+                self.assertIsNone(git_repo.apply_commit_message(timeout=0.1))
+                mock_error.assert_called_once()
+            self.assertEqual(raw_repo.head.commit.message.strip(), "aider: Edit file.txt")
+
+            ready.set()
+            self.assertIsNotNone(git_repo.apply_commit_message())
+            self.assertEqual(raw_repo.head.commit.message.strip(), "aider: a good commit message")
@@ -1,9 +1,20 @@
 import os
+import pickle
 import unittest
+from unittest.mock import patch
 
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
-from aider.repomap import RepoMap
+from aider.repomap import (
+    ParseSkipped,
+    RepoMap,
+    Tag,
+    TagTable,
+    get_tags_query,
+    get_tags_raw,
+    get_tree_edit,
+    parse_tree,
+)
 from aider.utils import IgnorantTemporaryDirectory
 
 
@@ -149,6 +160,441 @@ print(my_function(3, 4))
             # close the open cache files, so Windows won't error
             del repo_map
 
+    def test_get_repo_map_parallel_tags(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(8):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 8}()\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, map_processes=2)
+            repo_map.parallel_min_files = 1
+
+            serial_tags = [
+                TagTable.from_tags(repo_map.get_tags_raw(fname, repo_map.get_rel_fname(fname)))
+                for fname in fnames
+            ]
+
+            repo_map.prefetch_tags(fnames)
+
+            for fname, tags in zip(fnames, serial_tags):
+                self.assertEqual(repo_map.TAGS_CACHE[fname]["data"], tags)
+
+            result = repo_map.get_ranked_tags_map([], fnames)
+            self.assertIn("func3", result)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_tag_table(self):
+        tags = [
+            Tag("one.py", "/repo/one.py", 4, "beta", "def"),
+            Tag("one.py", "/repo/one.py", 0, "alpha", "def"),
+            Tag("one.py", "/repo/one.py", 9, "alpha", "def"),
+            Tag("one.py", "/repo/one.py", 2, "beta", "ref"),
+            Tag("one.py", "/repo/one.py", 7, "beta", "ref"),
+            Tag("one.py", "/repo/one.py", -1, "gamma", "ref"),
+        ]
+        table = TagTable.from_tags(tags)
+
+        self.assertEqual(len(table), len(tags))
+        self.assertEqual(table.get_def_names(), {"alpha", "beta"})
+        self.assertEqual(table.get_ref_counts(), {"beta": 2, "gamma": 1})
+        self.assertEqual(table.get_def_lines("alpha"), [0, 9])
+        self.assertEqual(table.get_def_lines("gamma"), [])
+        self.assertEqual(table.get_def_lines("missing"), [])
+        self.assertEqual(
+            sorted(table.get_tags("/repo/one.py", "one.py")),
+            sorted(tags),
+        )
+
+        # the cached form round trips, with names shared between tables
+        copy = pickle.loads(pickle.dumps(table))
+        self.assertEqual(copy, table)
+        self.assertIs(copy.names[0], table.names[0])
+
+    def test_tags_cache_is_read_and_written_in_bulk(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(5):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 5}()\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, map_processes=1)
+            with patch.object(repo_map, "save_tags_batch", wraps=repo_map.save_tags_batch) as save:
+                repo_map.get_ranked_tags([], fnames)
+                save.assert_called_once()
+                self.assertEqual(len(save.call_args.args[0]), len(fnames))
+            del repo_map
+
+            # a new session reads each file's entry once, and writes nothing back
+            repo_map = RepoMap(root=temp_dir, io=io, map_processes=1)
+            cache = repo_map.TAGS_CACHE
+            with patch.object(cache, "get", wraps=cache.get) as cache_get:
+                with patch.object(repo_map, "get_tags_raw") as get_tags_raw:
+                    ranked_tags = repo_map.get_ranked_tags([], fnames)
+                    get_tags_raw.assert_not_called()
+                    self.assertEqual(cache_get.call_count, len(fnames))
+
+            self.assertEqual(len(cache), len(fnames))
+            self.assertIn("func3", [tag[3] for tag in ranked_tags if len(tag) > 1])
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_get_tree_edit(self):
+        old = b"def one():\n    return 1\n"
+        new = b"def one():\n    x = 2\n    return x\n"
+        edit = get_tree_edit(old, new)
+
+        start, old_end, new_end = edit["start_byte"], edit["old_end_byte"], edit["new_end_byte"]
+        self.assertEqual(old[:start] + new[start:new_end] + old[old_end:], new)
+        self.assertEqual(edit["start_point"], (1, 4))
+        self.assertEqual(edit["old_end_point"], (1, 12))
+        self.assertEqual(edit["new_end_point"], (2, 12))
+
+        edit = get_tree_edit(old, old)
+        self.assertEqual(edit["start_byte"], edit["old_end_byte"])
+        self.assertEqual(edit["start_byte"], edit["new_end_byte"])
+
+    def test_update_file_reparses_incrementally(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "one.py")
+            other_fname = os.path.join(temp_dir, "two.py")
+            with open(other_fname, "w") as f:
+                f.write("def main():\n    return alpha() + beta()\n")
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), map_processes=1)
+            repo_map.get_ranked_tags([other_fname], [])
+
+            for i, content in enumerate(
+                [
+                    "def alpha():\n    return 1\n",
+                    "def alpha():\n    return 1\n\ndef beta():\n    return 2\n",
+                    "def beta():\n    return 2\n",
+                ]
+            ):
+                with open(fname, "w") as f:
+                    f.write(content)
+                repo_map.update_file(fname, content)
+
+                # the incremental parse matches a parse from scratch
+                _code, tree = repo_map.parse_trees.get(fname)
+                parser, _query = get_tags_query("python")
+                fresh = parser.parse(content.encode("utf-8"))
+                self.assertEqual(tree.root_node.sexp(), fresh.root_node.sexp())
+
+                with patch.object(repo_map, "get_tags_raw") as get_tags_raw:
+                    ranked_tags = repo_map.get_ranked_tags([other_fname], [fname])
+                    get_tags_raw.assert_not_called()
+
+                names = set(tag.name for tag in ranked_tags if type(tag) is Tag)
+                if i == 0:
+                    self.assertEqual(names, {"alpha"})
+                else:
+                    self.assertIn("beta", names)
+                if i == 2:
+                    self.assertNotIn("alpha", names)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_parse_budget_skips_pathological_files(self):
+        files = {
+            "normal.py": "def normal():\n    return 1\n",
+            "big.py": "def big():\n    return 1\n" + "# padding\n" * 200,
+            "minified.js": "function minified(){return 1};" + "var x=1;" * 200 + "\n",
+            "gen.py": "# Code generated by protoc. DO NOT EDIT.\ndef gen():\n    return 1\n",
+            "messages_pb2.py": "def message():\n    return 1\n",
+        }
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            for fname, content in files.items():
+                with open(os.path.join(temp_dir, fname), "w") as f:
+                    f.write(content)
+
+            repo_map = RepoMap(
+                root=temp_dir, io=InputOutput(), max_file_size=1000, max_line_length=500
+            )
+
+            for fname in files:
+                tags = repo_map.get_tags(os.path.join(temp_dir, fname), fname)
+                cached = repo_map.TAGS_CACHE[os.path.join(temp_dir, fname)]["data"]
+                if fname == "normal.py":
+                    self.assertIn("normal", [tag.name for tag in tags])
+                    self.assertIsNone(cached.skipped)
+                else:
+                    self.assertEqual(tags, [], fname)
+                    self.assertTrue(cached.skipped, fname)
+
+            # the skips are cached, and not retried
+            with patch.object(repo_map, "get_tags_raw") as mock_get_tags_raw:
+                for fname in files:
+                    repo_map.get_tags(os.path.join(temp_dir, fname), fname)
+                mock_get_tags_raw.assert_not_called()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_parse_tree_timeout(self):
+        parser, _query = get_tags_query("python")
+        code = b"x = [" + b"1, " * 100000 + b"]\n"
+
+        with self.assertRaises(ParseSkipped):
+            parse_tree(parser, code, timeout=0.000001)
+
+        # the timed out parse doesn't leak into the next one
+        tree = parse_tree(parser, b"def one():\n    return 1\n", timeout=5)
+        self.assertEqual(tree.root_node.children[0].type, "function_definition")
+
+    def test_refs_backfilled_from_tree(self):
+        code = (
+            "#include <stdio.h>\n"
+            "int helper(int x) { return x + 1; }\n"
+            "int main(void) { return helper(2) + other::value; }\n"
+        )
+        with patch("aider.repomap.guess_lexer_for_filename") as mock_guess_lexer:
+            tags = list(get_tags_raw("main.cpp", "main.cpp", code))
+            mock_guess_lexer.assert_not_called()
+
+        defs = set(tag.name for tag in tags if tag.kind == "def")
+        refs = set((tag.name, tag.line) for tag in tags if tag.kind == "ref")
+        self.assertIn("helper", defs)
+        self.assertIn(("helper", 2), refs)
+        self.assertIn(("value", 2), refs)
+        self.assertNotIn("other::value", set(name for name, _line in refs))
+
+    def test_get_tags_query_is_cached(self):
+        parser, query = get_tags_query("python")
+        self.assertIs(get_tags_query("python"), get_tags_query("python"))
+        self.assertIsNotNone(parser)
+        self.assertIsNotNone(query)
+
+        # markdown has a parser but no tags query
+        self.assertIsNone(get_tags_query("markdown"))
+
+    def test_shared_tags_cache(self):
+        file_content = "def my_function(arg1, arg2):\n    return arg1 * arg2\n"
+
+        with IgnorantTemporaryDirectory() as shared_dir:
+            io = InputOutput()
+
+            with IgnorantTemporaryDirectory() as temp_dir:
+                fname = os.path.join(temp_dir, "one.py")
+                with open(fname, "w") as f:
+                    f.write(file_content)
+
+                repo_map = RepoMap(root=temp_dir, io=io, shared_cache_dir=shared_dir)
+                tags = repo_map.get_tags(fname, "one.py")
+                self.assertIn("my_function", [tag.name for tag in tags])
+                del repo_map
+
+            # a different checkout with identical content should not re-parse
+            with IgnorantTemporaryDirectory() as temp_dir:
+                fname = os.path.join(temp_dir, "two.py")
+                with open(fname, "w") as f:
+                    f.write(file_content)
+
+                repo_map = RepoMap(root=temp_dir, io=io, shared_cache_dir=shared_dir)
+                with patch.object(repo_map, "get_tags_raw") as mock_get_tags_raw:
+                    tags = repo_map.get_tags(fname, "two.py")
+                    mock_get_tags_raw.assert_not_called()
+
+                self.assertIn("my_function", [tag.name for tag in tags])
+                self.assertEqual(set(tag.rel_fname for tag in tags), {"two.py"})
+                self.assertEqual(set(tag.fname for tag in tags), {fname})
+                del repo_map
+
+    def test_incremental_graph_matches_fresh_build(self):
+        files = {
+            "one.py": "def alpha():\n    return beta()\n",
+            "two.py": "def beta():\n    return gamma()\n",
+            "three.py": "def gamma():\n    return alpha()\n",
+        }
+
+        def graph_edges(repo_map):
+            return sorted(repo_map.graph.edges(keys=True, data="weight"))
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for name, content in files.items():
+                fname = os.path.join(temp_dir, name)
+                with open(fname, "w") as f:
+                    f.write(content)
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io)
+            repo_map.get_ranked_tags(fnames[:1], fnames[1:])
+
+            # change one file, and drop another from the repo
+            with open(fnames[1], "w") as f:
+                f.write("def beta():\n    return alpha() + delta()\n\ndef delta():\n    pass\n")
+            os.utime(fnames[1], (1, 1))
+
+            ranked_tags = repo_map.get_ranked_tags(fnames[:1], fnames[1:2])
+            ranked = repo_map.last_ranked
+
+            fresh_map = RepoMap(root=temp_dir, io=io)
+            fresh_ranked_tags = fresh_map.get_ranked_tags(fnames[:1], fnames[1:2])
+
+            self.assertEqual(graph_edges(repo_map), graph_edges(fresh_map))
+            self.assertEqual(sorted(ranked_tags), sorted(fresh_ranked_tags))
+            self.assertEqual(set(ranked), set(fresh_map.last_ranked))
+            for node, rank in fresh_map.last_ranked.items():
+                self.assertAlmostEqual(ranked[node], rank, places=4)
+
+            self.assertNotIn("three.py", repo_map.graph)
+            self.assertIn("delta", [tag[3] for tag in ranked_tags if len(tag) > 1])
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+            del fresh_map
+
+    def test_sparse_ranking_matches_networkx(self):
+        files = {
+            "one.py": "def alpha():\n    return beta() + gamma()\n",
+            "two.py": "def beta():\n    return gamma()\n\ndef unused():\n    pass\n",
+            "three.py": "def gamma():\n    return alpha() + beta() + beta()\n",
+            "four.py": "def delta():\n    return alpha()\n",
+            "five.md": "# nothing to see here\n",
+        }
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for name, content in files.items():
+                fname = os.path.join(temp_dir, name)
+                with open(fname, "w") as f:
+                    f.write(content)
+                fnames.append(fname)
+
+            io = InputOutput()
+            nx_map = RepoMap(root=temp_dir, io=io, ranking="networkx")
+            sparse_map = RepoMap(root=temp_dir, io=io, ranking="scipy")
+
+            for chat_fnames in ([], fnames[:1], fnames[3:4]):
+                other_fnames = [fname for fname in fnames if fname not in chat_fnames]
+                nx_tags = nx_map.get_ranked_tags(chat_fnames, other_fnames)
+                sparse_tags = sparse_map.get_ranked_tags(chat_fnames, other_fnames)
+
+                personalization = dict((nx_map.get_rel_fname(fname), 1.0) for fname in chat_fnames)
+                nx_ranked, nx_definitions = nx_map.rank_networkx(personalization)
+                sparse_ranked, sparse_definitions = sparse_map.rank_sparse(personalization)
+
+                self.assertEqual(set(nx_ranked), set(sparse_ranked))
+                for node, rank in nx_ranked.items():
+                    self.assertAlmostEqual(sparse_ranked[node], rank, places=5)
+
+                self.assertEqual(set(nx_definitions), set(sparse_definitions))
+                for key, rank in nx_definitions.items():
+                    self.assertAlmostEqual(sparse_definitions[key], rank, places=5)
+
+                self.assertEqual(sorted(nx_tags), sorted(sparse_tags))
+
+            # close the open cache files, so Windows won't error
+            del nx_map
+            del sparse_map
+
+    def test_get_ranked_tags_map_respects_budget(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(20):
+                fname = os.path.join(temp_dir, f"test_file{i:02}.py")
+                with open(fname, "w") as f:
+                    for j in range(10):
+                        f.write(f"def func_{i}_{j}():\n    return func_{(i + 1) % 20}_{j}()\n\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, map_tokens=512)
+
+            with patch.object(repo_map, "render_block", wraps=repo_map.render_block) as render:
+                result = repo_map.get_ranked_tags_map([], fnames)
+                num_renders = render.call_count
+
+            self.assertLess(repo_map.token_count(result), 512)
+            self.assertIn("func_", result)
+
+            # every rendered block is counted once, not once per bisection probe
+            num_tags = len(repo_map.get_ranked_tags([], fnames))
+            self.assertLess(num_renders, 2 * num_tags)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_render_cache_skips_unchanged_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(4):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 4}()\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, render_cache=True)
+            result = repo_map.get_ranked_tags_map([], fnames)
+
+            with patch("aider.repomap.TreeContext") as mock_tree_context:
+                self.assertEqual(repo_map.get_ranked_tags_map([], fnames), result)
+                mock_tree_context.assert_not_called()
+            del repo_map
+
+            # the rendered outlines were also saved on disk
+            repo_map = RepoMap(root=temp_dir, io=io, render_cache=True)
+            with patch("aider.repomap.TreeContext") as mock_tree_context:
+                self.assertEqual(repo_map.get_ranked_tags_map([], fnames), result)
+                mock_tree_context.assert_not_called()
+
+            with open(fnames[0], "w") as f:
+                f.write("def func0(changed):\n    return func1()\n")
+            os.utime(fnames[0], (1, 1))
+
+            result = repo_map.get_ranked_tags_map([], fnames)
+            self.assertIn("func0(changed)", result)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_get_repo_map_memoized(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io)
+            result = repo_map.get_repo_map([], fnames)
+
+            with patch.object(repo_map, "get_ranked_tags_map") as mock_map:
+                self.assertEqual(repo_map.get_repo_map([], fnames), result)
+                mock_map.assert_not_called()
+            self.assertEqual((repo_map.map_memo_hits, repo_map.map_memo_misses), (1, 1))
+
+            # a different chat file set is a miss
+            repo_map.get_repo_map(fnames[:1], fnames[1:])
+            self.assertEqual(repo_map.map_memo_misses, 2)
+
+            # so is a modified file
+            with open(fnames[2], "w") as f:
+                f.write("def func2(changed):\n    return func0()\n")
+            os.utime(fnames[2], (1, 1))
+            result = repo_map.get_repo_map(fnames[:1], fnames[1:])
+            self.assertEqual(repo_map.map_memo_misses, 3)
+            self.assertIn("func2(changed)", result)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
 
 if __name__ == "__main__":
     unittest.main()
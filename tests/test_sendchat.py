@@ -3,8 +3,12 @@ from unittest.mock import MagicMock, patch
 
 import httpx
 import openai
+from diskcache import Cache
+from openai.types.chat import ChatCompletionChunk
 
+from aider import sendchat
 from aider.sendchat import send_with_retries
+from aider.utils import IgnorantTemporaryDirectory
 
 
 class PrintCalled(Exception):
@@ -44,3 +48,83 @@ class TestSendChat(unittest.TestCase):
         # Call the send_with_retries method
         send_with_retries(mock_client, "model", ["message"], None, False)
         mock_print.assert_called_once()
+
+    @patch("builtins.print")
+    def test_send_with_retries_retry_output(self, mock_print):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = [
+            httpx.ConnectError("Connection error"),
+            None,
+        ]
+
+        notices = []
+        with sendchat.retry_output(notices.append):
+            send_with_retries(mock_client, "model", ["message"], None, False)
+
+        mock_print.assert_not_called()
+        self.assertEqual(len(notices), 1)
+        self.assertIn("Retry in", notices[0])
+        self.assertIsNone(sendchat.retry_notices.output)
+
+    def make_chunk(self, content):
+        return ChatCompletionChunk(
+            id="chunk",
+            choices=[dict(index=0, delta=dict(content=content), finish_reason=None)],
+            created=0,
+            model="model",
+            object="chat.completion.chunk",
+        )
+
+    def test_send_with_retries_caches_responses(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = "response"
+
+        with IgnorantTemporaryDirectory() as cache_dir:
+            with patch.object(sendchat, "CACHE", Cache(cache_dir)):
+                hash1, res1 = send_with_retries(mock_client, "model", ["message"], None, False)
+                hash2, res2 = send_with_retries(mock_client, "model", ["message"], None, False)
+
+                self.assertEqual(res2, "response")
+                self.assertEqual(hash1.hexdigest(), hash2.hexdigest())
+                mock_client.chat.completions.create.assert_called_once()
+
+                # a different request isn't served from the cache
+                send_with_retries(mock_client, "model", ["other"], None, False)
+                self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+    def test_send_with_retries_caches_streamed_chunks(self):
+        chunks = [self.make_chunk("hello"), self.make_chunk(" world")]
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = lambda **kwargs: iter(chunks)
+
+        with IgnorantTemporaryDirectory() as cache_dir:
+            with patch.object(sendchat, "CACHE", Cache(cache_dir)):
+                # a stream which isn't read to the end isn't cached
+                _hash, res = send_with_retries(mock_client, "model", ["message"], None, True)
+                next(res)
+                _hash, res = send_with_retries(mock_client, "model", ["message"], None, True)
+                self.assertEqual(list(res), chunks)
+                self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+                _hash, res = send_with_retries(mock_client, "model", ["message"], None, True)
+                self.assertEqual(list(res), chunks)
+                self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+                # streamed and non-streamed responses are cached separately
+                send_with_retries(mock_client, "model", ["message"], None, False)
+                self.assertEqual(mock_client.chat.completions.create.call_count, 3)
+
+    def test_cache_max_age_zero_is_no_limit(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = "response"
+
+        with IgnorantTemporaryDirectory() as cache_dir:
+            with patch.object(sendchat, "CACHE", None), patch.object(sendchat, "CACHE_MAX_AGE", 1):
+                sendchat.enable_cache(cache_dir, max_age=0)
+                self.assertIsNone(sendchat.CACHE_MAX_AGE)
+
+                send_with_retries(mock_client, "model", ["message"], None, False)
+                send_with_retries(mock_client, "model", ["message"], None, False)
+                mock_client.chat.completions.create.assert_called_once()
+
+                sendchat.CACHE.close()
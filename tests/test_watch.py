@@ -0,0 +1,150 @@
+import os
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from aider.dump import dump  # noqa: F401
+from aider.io import InputOutput
+from aider.repomap import RepoMap, RepoMapCancelled
+from aider.utils import IgnorantTemporaryDirectory
+from aider.watch import InotifyWatcher, PollingWatcher
+
+
+class TestWatch(unittest.TestCase):
+    def check_watcher(self, watcher, temp_dir, poll):
+        fname = Path(temp_dir) / "file.py"
+        fname.write_text("one\n")
+        watcher.track([str(fname)])
+        poll()
+
+        changed, seq = watcher.get_changes(None)
+        self.assertIsNone(changed)
+
+        changed, seq = watcher.get_changes(seq)
+        self.assertEqual(changed, set())
+
+        fname.write_text("two\n")
+        poll()
+        changed, seq = watcher.get_changes(seq)
+        self.assertEqual(changed, {str(fname)})
+        self.assertEqual(watcher.last_change([str(fname)]), seq)
+
+        fname.unlink()
+        poll()
+        changed, seq = watcher.get_changes(seq)
+        self.assertEqual(changed, {str(fname)})
+
+    @unittest.skipUnless(os.name == "posix" and os.uname().sysname == "Linux", "needs inotify")
+    def test_inotify_watcher(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            temp_dir = str(Path(temp_dir).resolve())
+            watcher = InotifyWatcher(temp_dir)
+            self.check_watcher(watcher, temp_dir, lambda: None)
+
+            # files in new directories are found too
+            _changed, seq = watcher.get_changes(None)
+            subdir = Path(temp_dir) / "subdir"
+            subdir.mkdir()
+            changed, seq = watcher.get_changes(seq)
+            self.assertIsNone(changed)
+
+            (subdir / "new.py").write_text("new\n")
+            changed, seq = watcher.get_changes(seq)
+            self.assertEqual(changed, {str(subdir / "new.py")})
+
+            watcher.close()
+
+    def test_polling_watcher(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            temp_dir = str(Path(temp_dir).resolve())
+            watcher = PollingWatcher(temp_dir, interval=3600)
+            self.check_watcher(watcher, temp_dir, watcher.scan)
+            watcher.close()
+
+    def test_repo_map_only_checks_changed_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            temp_dir = str(Path(temp_dir).resolve())
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                fnames.append(fname)
+
+            watcher = PollingWatcher(temp_dir, interval=3600)
+            watcher.track(fnames)
+            watcher.scan()
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), watcher=watcher)
+            repo_map.get_ranked_tags([], fnames)
+
+            with patch.object(repo_map, "get_mtime", wraps=repo_map.get_mtime) as mock_mtime:
+                repo_map.get_ranked_tags([], fnames)
+                mock_mtime.assert_not_called()
+
+                with open(fnames[1], "w") as f:
+                    f.write("def func1(changed):\n    return func2()\n")
+                watcher.scan()
+
+                ranked_tags = repo_map.get_ranked_tags([], fnames)
+                checked = set(call.args[0] for call in mock_mtime.call_args_list)
+                self.assertEqual(checked, {fnames[1]})
+
+            tags = [tag for tag in ranked_tags if tag[0] == "test_file1.py"]
+            self.assertEqual(len(tags), 1)
+
+            watcher.close()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_repo_map_cancelled_rechecks_changed_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            temp_dir = str(Path(temp_dir).resolve())
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(temp_dir, f"test_file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return func{(i + 1) % 3}()\n")
+                fnames.append(fname)
+
+            watcher = PollingWatcher(temp_dir, interval=3600)
+            watcher.track(fnames)
+            watcher.scan()
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), watcher=watcher)
+            repo_map.get_ranked_tags([], fnames)
+
+            for fname in fnames[1:]:
+                with open(fname, "w") as f:
+                    f.write("def brand_new_name():\n    return func0()\n")
+            watcher.scan()
+
+            # cancel the pass after the first file, as /add or /drop would
+            cancelled = threading.Event()
+            get_rel_fname = repo_map.get_rel_fname
+
+            def cancel_after_first(fname):
+                cancelled.set()
+                return get_rel_fname(fname)
+
+            repo_map.cancelled = cancelled
+            with patch.object(repo_map, "get_rel_fname", side_effect=cancel_after_first):
+                with self.assertRaises(RepoMapCancelled):
+                    repo_map.get_ranked_tags([], fnames)
+            repo_map.cancelled = None
+
+            repo_map.get_ranked_tags([], fnames)
+            self.assertEqual(repo_map.defines["brand_new_name"], {"test_file1.py", "test_file2.py"})
+            self.assertNotIn("func1", repo_map.defines)
+            self.assertNotIn("func2", repo_map.defines)
+
+            watcher.close()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+
+if __name__ == "__main__":
+    unittest.main()